@@ -0,0 +1,224 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Journal of cache uses, oldest first. Files may be hard-linked into the download folder,
+# so recency is not kept in their mtime: bumping it would change the user's file.
+JOURNAL_NAME = "lru.journal"
+
+
+class AudioCache:
+    """Size-capped LRU of transcoded audio files, keyed by YouTube video id plus codec and quality"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # file name -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._journal = None
+        self._journal_lines = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild the LRU order from the files already on disk and the use journal"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name == JOURNAL_NAME:
+                continue
+            if name.endswith('.tmp'):
+                # Left over from a write that never completed
+                os.unlink(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+
+        journal_path = os.path.join(self.cache_dir, JOURNAL_NAME)
+        try:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    name = line.rstrip('\n')
+                    if name in self._entries:
+                        self._entries.move_to_end(name)
+        except OSError:
+            pass
+
+        with self._lock:
+            self._evict()
+            self._compact_journal()
+        logging.info(f"Audio cache: {self.cache_dir} ({len(self._entries)} files, {self._total_bytes} bytes)")
+
+    @staticmethod
+    def _key(video_id: str, codec: str, quality: str) -> str:
+        safe_id = re.sub(r'[^\w\-]', '_', video_id)
+        return f"{safe_id}-{codec}-{quality}.{codec}"
+
+    def path_for(self, video_id: str, codec: str, quality: str) -> str:
+        return os.path.join(self.cache_dir, self._key(video_id, codec, quality))
+
+    def get(self, video_id: str, codec: str, quality: str) -> Optional[str]:
+        """Return the cached file path and mark it as recently used"""
+        key = self._key(video_id, codec, quality)
+        path = os.path.join(self.cache_dir, key)
+
+        with self._lock:
+            if key not in self._entries or not os.path.exists(path):
+                self._forget(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._record_use(key)
+
+        return path
+
+    def put(self, video_id: str, codec: str, quality: str, source_path: str, move: bool = False) -> Optional[str]:
+        """Atomically add a finished file to the cache, returning its cached path"""
+        size = os.path.getsize(source_path)
+        if size > self.max_bytes:
+            return None
+
+        key = self._key(video_id, codec, quality)
+        path = os.path.join(self.cache_dir, key)
+
+        try:
+            if move:
+                try:
+                    # Cheap when the source lives on the same filesystem
+                    os.replace(source_path, path)
+                except OSError:
+                    self._copy_into(source_path, path)
+                    os.unlink(source_path)
+            else:
+                try:
+                    # Shares the file's data instead of duplicating it
+                    self._link_into(source_path, path)
+                except OSError:
+                    self._copy_into(source_path, path)
+        except Exception as e:
+            logging.warning(f"Failed to cache audio for {video_id}: {e}")
+            return None
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._record_use(key)
+            self._evict()
+
+        return path
+
+    def copy_to(self, video_id: str, codec: str, quality: str, dest_path: str) -> bool:
+        """Place a cached file at dest_path, hard-linking when possible"""
+        path = self.get(video_id, codec, quality)
+        if not path:
+            return False
+
+        try:
+            os.link(path, dest_path)
+        except OSError:
+            try:
+                shutil.copyfile(path, dest_path)
+            except OSError as e:
+                logging.warning(f"Failed to copy cached audio for {video_id}: {e}")
+                return False
+        return True
+
+    def _link_into(self, source_path: str, path: str):
+        # Link under a temporary name and rename over the target, which os.link cannot replace
+        tmp_path = os.path.join(self.cache_dir, f"{uuid.uuid4().hex}.tmp")
+        os.link(source_path, tmp_path)
+        try:
+            os.replace(tmp_path, path)
+        finally:
+            # rename() is a no-op when both names already link to the same file
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _copy_into(self, source_path: str, path: str):
+        # Write next to the target and rename, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as dst, open(source_path, 'rb') as src:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _record_use(self, key: str):
+        """Append a use to the journal; caller holds the lock"""
+        if self._journal is None:
+            return
+        try:
+            self._journal.write(key + '\n')
+            self._journal.flush()
+        except OSError as e:
+            logging.warning(f"Failed to record audio cache use: {e}")
+            return
+        self._journal_lines += 1
+        if self._journal_lines > max(1000, 4 * len(self._entries)):
+            self._compact_journal()
+
+    def _compact_journal(self):
+        """Rewrite the journal as one line per cached file in LRU order; caller holds the lock"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        journal_path = os.path.join(self.cache_dir, JOURNAL_NAME)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.writelines(key + '\n' for key in self._entries)
+            os.replace(tmp_path, journal_path)
+            self._journal = open(journal_path, 'a', encoding='utf-8')
+        except OSError as e:
+            logging.warning(f"Audio cache use journal unavailable, LRU order will not survive restarts: {e}")
+            return
+        self._journal_lines = len(self._entries)
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.unlink(os.path.join(self.cache_dir, key))
+            except OSError:
+                pass
+            logging.info(f"Evicted cached audio: {key}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
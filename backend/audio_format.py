@@ -0,0 +1,81 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+# Output formats. MP3 is always encoded at a selectable bitrate; opus and m4a keep
+# YouTube's native stream (remuxed, no encode) whenever the source codec allows it.
+AUDIO_FORMATS: Dict[str, Dict] = {
+    "mp3": {
+        "media_type": "audio/mpeg",
+        "source": "bestaudio/best",
+        "muxer": "mp3",
+        "native_codecs": (),
+        "encoder": "libmp3lame",
+    },
+    "opus": {
+        "media_type": "audio/ogg",
+        "source": "bestaudio[acodec=opus]/bestaudio/best",
+        "muxer": "ogg",
+        "native_codecs": ("opus",),
+        "encoder": "libopus",
+        "fallback_bitrate": "160",
+    },
+    "m4a": {
+        "media_type": "audio/mp4",
+        "source": "bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best",
+        "muxer": "mp4",
+        "native_codecs": ("mp4a", "aac"),
+        "encoder": "aac",
+        "fallback_bitrate": "192",
+        # A plain MP4 needs a seekable output for its index; fragments can go to a pipe
+        "pipe_args": ["-movflags", "frag_keyframe+empty_moov"],
+    },
+}
+
+MP3_BITRATES = ("128", "192", "256", "320")
+
+# Quality recorded for remuxed formats, where the source decides the bitrate
+NATIVE_QUALITY = "native"
+
+DEFAULT_AUDIO_FORMAT = os.getenv("AUDIO_FORMAT", "mp3")
+DEFAULT_MP3_BITRATE = os.getenv("AUDIO_BITRATE", "192")
+
+
+def resolve_audio_format(audio_format: Optional[str] = None, bitrate: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Validate a requested format and bitrate, falling back to the server defaults.
+    Returns (codec, quality); quality is the MP3 bitrate, or NATIVE_QUALITY for remuxed formats.
+    """
+    codec = (audio_format or DEFAULT_AUDIO_FORMAT).lower()
+    if codec not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio format: {codec} (choose from {', '.join(AUDIO_FORMATS)})")
+
+    if codec != "mp3":
+        return codec, NATIVE_QUALITY
+
+    quality = str(bitrate or DEFAULT_MP3_BITRATE).lower().rstrip("k")
+    if quality not in MP3_BITRATES:
+        raise ValueError(f"Unsupported MP3 bitrate: {quality} (choose from {', '.join(MP3_BITRATES)})")
+    return codec, quality
+
+
+def can_copy(codec: str, source_acodec: Optional[str]) -> bool:
+    """Whether the source audio can be remuxed into codec's container without encoding"""
+    if not source_acodec:
+        return False
+    return any(source_acodec.lower().startswith(native) for native in AUDIO_FORMATS[codec]["native_codecs"])
+
+
+def encode_bitrate(codec: str, quality: str) -> str:
+    """Bitrate (kbps) to encode at when the source has to be re-encoded"""
+    return quality if quality != NATIVE_QUALITY else AUDIO_FORMATS[codec]["fallback_bitrate"]
+
+
+def ffmpeg_codec_args(codec: str, quality: str, source_acodec: Optional[str] = None) -> List[str]:
+    """ffmpeg audio codec arguments: a stream copy when possible, otherwise an encode"""
+    if can_copy(codec, source_acodec):
+        return ['-codec:a', 'copy']
+    return ['-codec:a', AUDIO_FORMATS[codec]["encoder"], '-b:a', f'{encode_bitrate(codec, quality)}k']
+
+
+def media_type(codec: str) -> str:
+    return AUDIO_FORMATS[codec]["media_type"]
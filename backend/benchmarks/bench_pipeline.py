@@ -0,0 +1,232 @@
+"""
+Offline throughput benchmark for the playlist pipeline.
+
+Spotify is replaced by a local fake Web API (fake_spotify.py) and YouTube by a yt-dlp
+stub with configurable latency (stub_ytdl.py); transcoding runs the real ffmpeg on a
+generated tone. Each scenario/size runs in a fresh process, so peak RSS is per run.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --sizes 100,1000 --scenarios batch_links --search-latency 0.1
+
+Scenarios:
+    playlist_tracks  SpotifyDownloaderAPI.get_playlist_tracks (latency per page request)
+    batch_links      playlist fetch + the batch-youtube-links resolver (latency per track)
+    download         start_download through to completion (latency per track, first
+                     checkpoint to done/failed)
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ("playlist_tracks", "batch_links", "download")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench_playlist_tracks(api, client, playlist_id: str) -> Dict:
+    page_latencies = []
+    fetch_page = client.playlist_tracks
+
+    def timed_fetch_page(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fetch_page(*args, **kwargs)
+        finally:
+            page_latencies.append(time.perf_counter() - start)
+
+    client.playlist_tracks = timed_fetch_page
+
+    start = time.perf_counter()
+    tracks = api.get_playlist_tracks(playlist_id)
+    elapsed = time.perf_counter() - start
+    return {"tracks": len(tracks), "ok": len(tracks), "seconds": elapsed,
+            "latencies": page_latencies, "latency_unit": "page"}
+
+
+def bench_batch_links(api, client, playlist_id: str) -> Dict:
+    import main
+
+    async def run():
+        start = time.perf_counter()
+        tracks = api.get_playlist_tracks(playlist_id)
+        latencies = []
+        ok = 0
+        async for result in main._resolve_playlist_links(tracks):
+            latencies.append(time.perf_counter() - start)
+            ok += 1 if result.get("success") else 0
+        return len(tracks), ok, time.perf_counter() - start, latencies
+
+    total, ok, elapsed, latencies = asyncio.run(run())
+    return {"tracks": total, "ok": ok, "seconds": elapsed, "latencies": latencies, "latency_unit": "track"}
+
+
+def bench_download(api, client, playlist_id: str) -> Dict:
+    first_seen: Dict = {}
+    finished: Dict = {}
+    set_track_state = api.download_queue.set_track_state
+
+    def timed_set_track_state(job_id, position, state, *args, **kwargs):
+        now = time.perf_counter()
+        first_seen.setdefault(position, now)
+        if state in ("done", "failed"):
+            finished[position] = (now, state)
+        return set_track_state(job_id, position, state, *args, **kwargs)
+
+    api.download_queue.set_track_state = timed_set_track_state
+
+    start = time.perf_counter()
+    job_id = api.start_download(f"https://open.spotify.com/playlist/{playlist_id}")["job_id"]
+    while api.jobs.get(job_id).is_active:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    job = api.jobs.get(job_id)
+    if job.progress.get("status") != "completed":
+        raise RuntimeError(f"Download job ended as {job.progress.get('status')}: {job.progress.get('error')}")
+
+    latencies = [done_at - first_seen[position] for position, (done_at, _) in finished.items()]
+    ok = sum(1 for _, state in finished.values() if state == "done")
+    return {"tracks": job.progress.get("total", 0), "ok": ok, "seconds": elapsed,
+            "latencies": latencies, "latency_unit": "track"}
+
+
+def run_child(args) -> Dict:
+    """Body of one benchmark process; the environment already points at a scratch directory"""
+    from fake_spotify import fake_spotify_client, playlist_id_for, start_fake_spotify
+    from stub_ytdl import generate_tone, install_stub
+
+    tone_path = os.path.join(os.getcwd(), "tone.webm")
+    # Only downloads read the audio; the other scenarios run without ffmpeg
+    if args.child == "download":
+        generate_tone(tone_path, args.tone_seconds)
+    install_stub(tone_path, search_latency=args.search_latency, download_latency=args.download_latency,
+                 not_found_every=args.not_found_every)
+    _, prefix = start_fake_spotify(latency=args.spotify_latency, throttle_every=args.spotify_throttle_every)
+
+    import main
+    # The app's own pooled, retrying client, so throttling is handled as in production
+    client = fake_spotify_client(prefix, main.api.spotify_client)
+    main.api.sp = client
+
+    runner = {
+        "playlist_tracks": bench_playlist_tracks,
+        "batch_links": bench_batch_links,
+        "download": bench_download,
+    }[args.child]
+    result = runner(main.api, client, playlist_id_for(args.size))
+
+    latencies = result.pop("latencies")
+    result.update({
+        "scenario": args.child,
+        "size": args.size,
+        "tracks_per_sec": result["tracks"] / result["seconds"] if result["seconds"] else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "peak_child_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    })
+    return result
+
+
+def run_scenario(scenario: str, size: int, args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix=f"bench-{scenario}-{size}-")
+    env = dict(
+        os.environ,
+        DOWNLOAD_DIR=os.path.join(workdir, "downloads"),
+        DOWNLOAD_QUEUE_PATH=os.path.join(workdir, "queue.db"),
+        YOUTUBE_CACHE_PATH=os.path.join(workdir, "youtube_cache.db"),
+        AUDIO_CACHE_DIR=os.path.join(workdir, "audio_cache"),
+        YOUTUBE_SEARCH_RATE=str(args.search_rate),
+        YOUTUBE_SEARCH_BURST=str(max(1, int(args.search_rate))),
+    )
+    env.pop("PLAYLIST_CACHE_DIR", None)
+
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child", scenario, "--size", str(size),
+        "--spotify-latency", str(args.spotify_latency), "--search-latency", str(args.search_latency),
+        "--download-latency", str(args.download_latency), "--tone-seconds", str(args.tone_seconds),
+    ]
+    if args.not_found_every:
+        command += ["--not-found-every", str(args.not_found_every)]
+    if args.spotify_throttle_every:
+        command += ["--spotify-throttle-every", str(args.spotify_throttle_every)]
+
+    try:
+        # The app logs every track; keep that out of the report but available on failure
+        with open(os.path.join(workdir, "child.log"), "w+") as log:
+            process = subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=log, text=True)
+            if process.returncode != 0:
+                log.seek(0)
+                tail = log.read()[-4000:]
+                raise RuntimeError(f"{scenario}/{size} failed:\n{tail}")
+        return json.loads(process.stdout.strip().splitlines()[-1])
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--sizes", default="100,1000,10000", help="playlist sizes for playlist_tracks and batch_links")
+    parser.add_argument("--download-sizes", default="100", help="playlist sizes for the download scenario")
+    parser.add_argument("--spotify-latency", type=float, default=0.02, help="seconds per fake Spotify request")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="seconds per stub YouTube search")
+    parser.add_argument("--download-latency", type=float, default=0.2, help="seconds per stub YouTube download")
+    parser.add_argument("--tone-seconds", type=float, default=30, help="length of the downloaded tone (file size)")
+    parser.add_argument("--search-rate", type=float, default=1000, help="YOUTUBE_SEARCH_RATE for the run")
+    parser.add_argument("--not-found-every", type=int, default=0, help="make roughly 1 in N searches miss")
+    parser.add_argument("--spotify-throttle-every", type=int, default=0,
+                        help="answer every N-th Spotify request with 429 Retry-After: 1")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep each run's scratch directory")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    results = []
+    print(f"{'scenario':<16}{'size':>7}{'ok':>7}{'seconds':>10}{'tracks/s':>11}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'rss MB':>9}{'child MB':>10}  latency per")
+    for scenario in [s for s in args.scenarios.split(",") if s]:
+        sizes = args.download_sizes if scenario == "download" else args.sizes
+        for size in [int(s) for s in sizes.split(",") if s]:
+            result = run_scenario(scenario, size, args)
+            results.append(result)
+            print(f"{scenario:<16}{size:>7}{result['ok']:>7}{result['seconds']:>10.2f}{result['tracks_per_sec']:>11.1f}"
+                  f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['peak_rss_mb']:>9.1f}"
+                  f"{result['peak_child_rss_mb']:>10.1f}  {result['latency_unit']}", flush=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
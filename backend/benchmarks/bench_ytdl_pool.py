@@ -0,0 +1,81 @@
+"""
+Per-call overhead of building a YoutubeDL versus leasing one from YoutubeDLPool.
+
+Runs offline: each call constructs (or leases) an instance and looks up the
+extractors a ytsearch/watch call would use, without touching the network.
+
+    python benchmarks/bench_ytdl_pool.py [iterations]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yt_dlp import YoutubeDL  # noqa: E402
+
+from ytdl_pool import YoutubeDLPool  # noqa: E402
+
+FLAT_SEARCH_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+    'skip_download': True,
+}
+
+
+def touch_extractors(ydl: YoutubeDL):
+    ydl.get_info_extractor('YoutubeSearch')
+    ydl.get_info_extractor('Youtube')
+
+
+def fresh_call():
+    with YoutubeDL(FLAT_SEARCH_OPTS) as ydl:
+        touch_extractors(ydl)
+
+
+def pooled_call(pool: YoutubeDLPool):
+    with pool.acquire("flat_search") as ydl:
+        touch_extractors(ydl)
+
+
+def measure(fn, iterations: int):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<8} mean {statistics.mean(timings) * 1000:8.3f} ms   "
+          f"p50 {statistics.median(timings) * 1000:8.3f} ms   p99 {p99 * 1000:8.3f} ms")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    pool = YoutubeDLPool(max_idle_per_profile=1)
+    pool.register("flat_search", FLAT_SEARCH_OPTS)
+
+    # Warm imports and the lazily loaded extractor classes for both paths
+    fresh_call()
+    pooled_call(pool)
+
+    fresh = measure(fresh_call, iterations)
+    pooled = measure(lambda: pooled_call(pool), iterations)
+
+    print(f"{iterations} calls per variant")
+    report("fresh", fresh)
+    report("pooled", pooled)
+    saved = statistics.mean(fresh) - statistics.mean(pooled)
+    print(f"saved    {saved * 1000:8.3f} ms per call ({statistics.mean(fresh) / statistics.mean(pooled):.0f}x)")
+    print(f"pool     {pool.stats()}")
+
+
+if __name__ == "__main__":
+    main()
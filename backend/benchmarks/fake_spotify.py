@@ -0,0 +1,119 @@
+"""
+Local stand-in for the Spotify Web API endpoints the downloader reads.
+
+Playlist ids encode their size: "bench100" has 100 synthetic tracks, "bench10000" has 10,000.
+With throttle_every set, every n-th request is answered 429 with a Retry-After header.
+"""
+import json
+import re
+import itertools
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import spotipy
+
+PLAYLIST_ID_PATTERN = re.compile(r'^bench(\d+)$')
+MAX_PAGE_SIZE = 100
+
+
+def playlist_id_for(size: int) -> str:
+    return f"bench{size}"
+
+
+def synthetic_track(index: int) -> Dict:
+    return {
+        "track": {
+            "id": f"benchtrack{index:06d}",
+            "name": f"Benchmark Track {index}",
+            "type": "track",
+            "duration_ms": 180000 + (index % 60) * 1000,
+            "preview_url": None,
+            "external_urls": {"spotify": f"https://open.spotify.com/track/benchtrack{index:06d}"},
+            "artists": [{"name": f"Benchmark Artist {index % 50}"}],
+        }
+    }
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    server_version = "FakeSpotify/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+
+        if self.server.throttle_every and next(self.server.request_count) % self.server.throttle_every == 0:
+            return self._send(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                              {"Retry-After": str(self.server.retry_after)})
+
+        parsed = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        parts = parsed.path.strip("/").split("/")
+        # v1/playlists/<id>[/tracks]; newer spotipy releases request /items instead of /tracks
+        if len(parts) < 3 or parts[:2] != ["v1", "playlists"]:
+            return self._send(404, {"error": {"status": 404, "message": "Not found"}})
+
+        match = PLAYLIST_ID_PATTERN.match(parts[2])
+        if not match:
+            return self._send(404, {"error": {"status": 404, "message": "Invalid playlist Id"}})
+        size = int(match.group(1))
+
+        if len(parts) == 3:
+            return self._send(200, {
+                "id": parts[2],
+                "name": f"Benchmark {size}",
+                "snapshot_id": f"snapshot-{size}",
+                "tracks": self._page(size, 0, MAX_PAGE_SIZE),
+            })
+        if parts[3] in ("tracks", "items"):
+            offset = int(query.get("offset", ["0"])[0])
+            limit = min(int(query.get("limit", [str(MAX_PAGE_SIZE)])[0]), MAX_PAGE_SIZE)
+            return self._send(200, self._page(size, offset, limit))
+        return self._send(404, {"error": {"status": 404, "message": "Not found"}})
+
+    @staticmethod
+    def _page(size: int, offset: int, limit: int) -> Dict:
+        return {
+            "total": size,
+            "offset": offset,
+            "limit": limit,
+            "items": [synthetic_track(i) for i in range(offset, min(offset + limit, size))],
+        }
+
+    def _send(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_fake_spotify(latency: float = 0.0, throttle_every: int = 0,
+                       retry_after: int = 1) -> Tuple[ThreadingHTTPServer, str]:
+    """Serve the fake API on a free local port; returns the server and its /v1/ prefix"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSpotifyHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.throttle_every = throttle_every
+    server.retry_after = retry_after
+    # Starts at 1, so the very first request is not the one throttled
+    server.request_count = itertools.count(1)
+    threading.Thread(target=server.serve_forever, name="fake-spotify", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/"
+
+
+def fake_spotify_client(prefix: str, client: Optional[spotipy.Spotify] = None) -> spotipy.Spotify:
+    """Point a client (the app's shared one, or a plain new one) at the fake API"""
+    if client is None:
+        client = spotipy.Spotify(auth="benchmark-token", retries=0)
+    else:
+        client.set_auth("benchmark-token")
+    client.prefix = prefix
+    return client
@@ -0,0 +1,63 @@
+"""
+Stand-in for YouTube behind yt-dlp: searches and downloads answer after a configurable
+delay, and "downloads" are copies of a locally generated tone file, so the real ffmpeg
+transcode stage still has genuine audio to work on.
+"""
+import hashlib
+import shutil
+import subprocess
+import time
+from typing import Optional
+
+from yt_dlp import YoutubeDL
+
+
+def generate_tone(path: str, seconds: float) -> str:
+    """Write an Opus-in-WebM sine tone, the shape of a typical YouTube audio stream"""
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError("ffmpeg is required to generate benchmark audio")
+    subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+         '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={seconds}',
+         '-codec:a', 'libopus', '-b:a', '128k', path],
+        check=True
+    )
+    return path
+
+
+def install_stub(tone_path: str, search_latency: float = 0.05, download_latency: float = 0.2,
+                 not_found_every: Optional[int] = None):
+    """
+    Replace YoutubeDL.extract_info for this process. Every n-th distinct query
+    (not_found_every) returns no results, to exercise the failure paths.
+    """
+
+    def video_id_for(query: str) -> str:
+        return hashlib.sha1(query.encode()).hexdigest()[:11]
+
+    def extract_info(self, url, download=True, **kwargs):
+        if url.startswith("ytsearch"):
+            time.sleep(search_latency)
+            prefix, query = url.split(":", 1)
+            if not_found_every and int(video_id_for(query), 16) % not_found_every == 0:
+                return {"_type": "playlist", "entries": []}
+            entries = [{"id": video_id_for(query), "title": query, "duration": 180}]
+            # Multi-candidate searches lead with a decoy the ranking has to skip
+            if prefix != "ytsearch1":
+                entries.insert(0, {"id": video_id_for(f"loop {query}"), "title": f"{query} (1 hour loop)",
+                                   "duration": 3600})
+            return {"_type": "playlist", "entries": entries}
+
+        video_id = url.rsplit("=", 1)[-1]
+        info = {"id": video_id, "title": video_id, "ext": "webm", "acodec": "opus", "url": tone_path}
+        if not download:
+            return info
+
+        time.sleep(download_latency)
+        path = self.prepare_filename(info)
+        shutil.copyfile(tone_path, path)
+        for hook in self._post_hooks:
+            hook(path)
+        return info
+
+    YoutubeDL.extract_info = extract_info
@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from log_bus import LogBus
+
+
+class DownloadJob:
+    """One playlist download request with its own progress, log and cancellation"""
+
+    ACTIVE_STATUSES = ("queued", "starting", "downloading")
+
+    def __init__(self, playlist_url: str, track_ids: Optional[List[str]] = None,
+                 job_id: Optional[str] = None, log_capacity: int = 500,
+                 on_status_change: Optional[Callable[["DownloadJob"], None]] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.playlist_url = playlist_url
+        self.track_ids = track_ids
+        self.created_at = time.time()
+        self.progress: Dict = {"current": 0, "total": 0, "status": "queued"}
+        self.log = LogBus(capacity=log_capacity)
+        self.on_status_change = on_status_change
+
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def is_active(self) -> bool:
+        return self.progress["status"] in self.ACTIVE_STATUSES
+
+    def cancel(self):
+        self._cancel_event.set()
+        # A job still waiting for a slot will never start
+        if self.progress["status"] == "queued":
+            self.update(status="cancelled")
+
+    def update(self, **fields):
+        with self._lock:
+            status_changed = "status" in fields and fields["status"] != self.progress.get("status")
+            self.progress.update(fields)
+
+        if status_changed and self.on_status_change:
+            self.on_status_change(self)
+
+    def increment(self, field: str, amount: int = 1):
+        with self._lock:
+            self.progress[field] = self.progress.get(field, 0) + amount
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "playlist_url": self.playlist_url,
+                "track_ids": self.track_ids,
+                "created_at": self.created_at,
+                "progress": dict(self.progress),
+            }
+
+
+class FairTrackScheduler:
+    """
+    Fixed pool of worker threads shared by every job. Queued tracks are taken from
+    jobs in round-robin order, so a long playlist cannot starve jobs started after it.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._cond = threading.Condition()
+
+        for i in range(max_workers):
+            threading.Thread(target=self._worker, name=f"track-download-{i}", daemon=True).start()
+
+    def submit(self, job_id: str, fn: Callable, *args) -> Future:
+        future = Future()
+        with self._cond:
+            self._queues.setdefault(job_id, deque()).append((future, fn, args))
+            self._cond.notify()
+        return future
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _next_task(self):
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+
+            # Take one task from the job at the front, then send that job to the back
+            job_id, queue = self._queues.popitem(last=False)
+            task = queue.popleft()
+            if queue:
+                self._queues[job_id] = queue
+            return task
+
+    def _worker(self):
+        while True:
+            future, fn, args = self._next_task()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class JobManager:
+    """Registry of download jobs; at most max_active_jobs run at once, the rest wait their turn"""
+
+    def __init__(self, run_job: Callable[[DownloadJob], None], max_active_jobs: int = 4,
+                 max_finished_jobs: int = 50,
+                 on_status_change: Optional[Callable[[DownloadJob], None]] = None):
+        self._run_job = run_job
+        self._on_status_change = on_status_change
+        self._job_slots = threading.BoundedSemaphore(max_active_jobs)
+        self._max_finished_jobs = max_finished_jobs
+        self._jobs: "OrderedDict[str, DownloadJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, playlist_url: str, track_ids: Optional[List[str]] = None,
+               job_id: Optional[str] = None, created_at: Optional[float] = None) -> DownloadJob:
+        """Queue a new job, or re-queue a persisted one when job_id is given"""
+        job = DownloadJob(playlist_url, track_ids, job_id=job_id, on_status_change=self._on_status_change)
+        if created_at is not None:
+            job.created_at = created_at
+        if self._on_status_change:
+            self._on_status_change(job)
+
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+        threading.Thread(target=self._run, args=(job,), name=f"job-{job.id}", daemon=True).start()
+        return job
+
+    def _run(self, job: DownloadJob):
+        with self._job_slots:
+            if job.cancelled:
+                return
+            try:
+                self._run_job(job)
+            except Exception as e:
+                logging.error(f"Job {job.id} failed: {e}")
+                job.update(status="error", error=str(e))
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the retention limit"""
+        finished = [job_id for job_id, job in self._jobs.items() if not job.is_active]
+        for job_id in finished[:max(0, len(finished) - self._max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[DownloadJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def latest(self) -> Optional[DownloadJob]:
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    def active(self) -> List[DownloadJob]:
+        return [job for job in self.list() if job.is_active]
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if not job:
+            return False
+        job.cancel()
+        return True
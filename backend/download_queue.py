@@ -0,0 +1,219 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Per-track checkpoints, in the order a track normally moves through them
+TRACK_STATES = ("pending", "resolving", "downloading", "transcoding", "done", "failed")
+
+# Job statuses that mean the job still has work left after a restart
+UNFINISHED_JOB_STATUSES = ("queued", "starting", "downloading")
+
+
+class DownloadQueue:
+    """SQLite (WAL mode) record of jobs and per-track checkpoints, so downloads survive restarts"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL keeps committed checkpoints safe across crashes at NORMAL sync
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    playlist_url TEXT NOT NULL,
+                    track_ids TEXT,
+                    download_folder TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS job_tracks (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    track_id TEXT,
+                    track_json TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    file_path TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, position)
+                );
+                CREATE TABLE IF NOT EXISTS track_manifest (
+                    track_id TEXT PRIMARY KEY,
+                    file_path TEXT NOT NULL,
+                    downloaded_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS playlist_manifest (
+                    playlist_id TEXT NOT NULL,
+                    track_id TEXT NOT NULL,
+                    PRIMARY KEY (playlist_id, track_id)
+                );
+                """
+            )
+            self._conn.commit()
+        logging.info(f"Download queue: {db_path}")
+
+    def add_job(self, job_id: str, playlist_url: str, track_ids: Optional[List[str]],
+                download_folder: str, status: str, created_at: float):
+        with self._lock:
+            # A resumed job keeps the folder its finished tracks were written to
+            self._conn.execute(
+                "INSERT INTO jobs (id, playlist_url, track_ids, download_folder, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at",
+                (job_id, playlist_url, json.dumps(track_ids) if track_ids is not None else None,
+                 download_folder, status, created_at, time.time())
+            )
+            self._conn.commit()
+
+    def add_tracks(self, job_id: str, tracks: List[Dict]):
+        """Checkpoint a job's full track list as pending, in playlist order"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO job_tracks (job_id, position, track_id, track_json, state, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?)",
+                [
+                    (job_id, position, (track_info.get('track') or {}).get('id'), json.dumps(track_info), now)
+                    for position, track_info in enumerate(tracks)
+                ]
+            )
+            self._conn.commit()
+
+    def set_track_state(self, job_id: str, position: int, state: str,
+                        file_path: Optional[str] = None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_tracks SET state = ?, file_path = COALESCE(?, file_path), error = ?, updated_at = ? "
+                "WHERE job_id = ? AND position = ?",
+                (state, file_path, error, time.time(), job_id, position)
+            )
+            self._conn.commit()
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, playlist_url, track_ids, download_folder, status, created_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "playlist_url": row[1],
+            "track_ids": json.loads(row[2]) if row[2] is not None else None,
+            "download_folder": row[3],
+            "status": row[4],
+            "created_at": row[5],
+        }
+
+    def unfinished_jobs(self) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, playlist_url, track_ids, download_folder, created_at FROM jobs "
+                f"WHERE status IN ({','.join('?' * len(UNFINISHED_JOB_STATUSES))}) ORDER BY created_at",
+                UNFINISHED_JOB_STATUSES
+            ).fetchall()
+
+        return [
+            {
+                "id": row[0],
+                "playlist_url": row[1],
+                "track_ids": json.loads(row[2]) if row[2] is not None else None,
+                "download_folder": row[3],
+                "created_at": row[4],
+            }
+            for row in rows
+        ]
+
+    def job_tracks(self, job_id: str) -> List[Dict]:
+        """Checkpointed tracks of a job in playlist order; empty if the list was never fetched"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, track_json, state, file_path FROM job_tracks WHERE job_id = ? ORDER BY position",
+                (job_id,)
+            ).fetchall()
+
+        return [
+            {"position": row[0], "track_info": json.loads(row[1]), "state": row[2], "file_path": row[3]}
+            for row in rows
+        ]
+
+    def record_download(self, track_id: str, file_path: str, playlist_id: Optional[str] = None):
+        """Add a finished track to the manifest, and to the playlist it was downloaded for"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO track_manifest (track_id, file_path, downloaded_at) VALUES (?, ?, ?)",
+                (track_id, file_path, time.time())
+            )
+            if playlist_id:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO playlist_manifest (playlist_id, track_id) VALUES (?, ?)",
+                    (playlist_id, track_id)
+                )
+            self._conn.commit()
+
+    def manifest_files(self, track_ids: List[str]) -> Dict[str, str]:
+        """Map the given track ids to their downloaded file paths, where the manifest has one"""
+        files = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(track_ids), 500):
+                chunk = track_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT track_id, file_path FROM track_manifest WHERE track_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                files.update(rows)
+        return files
+
+    def playlist_members(self, playlist_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT track_id FROM playlist_manifest WHERE playlist_id = ?", (playlist_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def set_playlist_members(self, playlist_id: str, track_ids: List[str]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO playlist_manifest (playlist_id, track_id) VALUES (?, ?)",
+                [(playlist_id, track_id) for track_id in track_ids]
+            )
+            self._conn.commit()
+
+    def remove_from_playlist(self, playlist_id: str, track_ids: List[str]) -> List[str]:
+        """
+        Drop tracks from a playlist's manifest. Returns the file paths of tracks no other
+        playlist still references; their manifest entries are removed too.
+        """
+        orphaned_files = []
+        with self._lock:
+            for track_id in track_ids:
+                self._conn.execute(
+                    "DELETE FROM playlist_manifest WHERE playlist_id = ? AND track_id = ?",
+                    (playlist_id, track_id)
+                )
+                still_used = self._conn.execute(
+                    "SELECT 1 FROM playlist_manifest WHERE track_id = ? LIMIT 1", (track_id,)
+                ).fetchone()
+                if still_used:
+                    continue
+
+                row = self._conn.execute(
+                    "SELECT file_path FROM track_manifest WHERE track_id = ?", (track_id,)
+                ).fetchone()
+                self._conn.execute("DELETE FROM track_manifest WHERE track_id = ?", (track_id,))
+                if row:
+                    orphaned_files.append(row[0])
+            self._conn.commit()
+        return orphaned_files
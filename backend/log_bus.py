@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from collections import deque
+from typing import List, Tuple
+
+
+class LogBus:
+    """
+    Fixed-size ring buffer of log lines with increasing sequence ids.
+    Lines can be published from any thread and are pushed to async subscribers,
+    which can resume from the last id they saw.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self._buffer: "deque[Tuple[int, str]]" = deque(maxlen=capacity)
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    def publish(self, message: str) -> int:
+        with self._lock:
+            seq = self._next_id
+            self._next_id += 1
+            self._buffer.append((seq, message))
+            waiters = list(self._waiters)
+
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The subscriber's event loop has already shut down
+                pass
+        return seq
+
+    def snapshot(self) -> List[str]:
+        with self._lock:
+            return [message for _, message in self._buffer]
+
+    def since(self, last_id: int) -> List[Tuple[int, str]]:
+        """Buffered entries newer than last_id; older ones may have been overwritten"""
+        with self._lock:
+            return [entry for entry in self._buffer if entry[0] > last_id]
+
+    async def subscribe(self, last_id: int = 0, keepalive: float = 15.0):
+        """
+        Yield (seq, message) entries after last_id as they are published.
+        Yields None after `keepalive` idle seconds so callers can keep connections alive.
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            # An id this bus never issued comes from before a restart: replay the whole buffer
+            if last_id >= self._next_id:
+                last_id = 0
+            self._waiters.add(waiter)
+
+        try:
+            while True:
+                waiter[1].clear()
+                for entry in self.since(last_id):
+                    last_id = entry[0]
+                    yield entry
+
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
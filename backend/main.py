@@ -3,7 +3,6 @@ from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.responses import JSONResponse
-import io
 import shutil
 import uuid
 import time
@@ -14,19 +13,29 @@ from yt_dlp import YoutubeDL
 import re
 import urllib.parse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Callable, Optional, List, Tuple
 from spotify_api import SpotifyDownloaderAPI
-import spotipy
+from audio_format import AUDIO_FORMATS, MP3_BITRATES, NATIVE_QUALITY, encode_bitrate, ffmpeg_codec_args, media_type, resolve_audio_format
+from youtube_cache import REASON_BOT_BLOCKED, REASON_NOT_FOUND, REASON_TIMEOUT, failure_reason
+from youtube_access import SEARCH_LATENCY_TARGET, YouTubeUnavailable
+from youtube_match import TrackMatcher, search_url
+from rate_limit import TokenBucket
+from zip_stream import stream_zip
+from metrics import REGISTRY, track_stage
+from profiling import ProfileStore, SamplingProfiler
 import uvicorn
 import asyncio
 import logging
 from pathlib import Path
 import os
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
 from concurrent.futures import ThreadPoolExecutor
 import tempfile
 import json
 import base64
+import hmac
 import atexit
 import platform
 import subprocess
@@ -52,9 +61,69 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition", "Content-Length"]
+    expose_headers=["Content-Disposition", "Content-Length", "X-Profile-Id"]
 )
 
+# Opt-in request profiling: admins send X-Profile: 1 (or ?profile=1) plus X-Admin-Token.
+# Disabled entirely unless PROFILE_ADMIN_TOKEN is set.
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")
+profile_store = ProfileStore(max_entries=int(os.getenv("PROFILE_STORE_SIZE", "20")))
+
+
+def _is_profile_admin(request: Request) -> bool:
+    token = request.headers.get("x-admin-token")
+    return bool(PROFILE_ADMIN_TOKEN and token and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN))
+
+
+def _require_profile_admin(request: Request):
+    if not PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not _is_profile_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+class ProfileMiddleware:
+    """
+    Samples requests that ask for a profile, including the time spent streaming the body.
+    Plain ASGI, so every other request is passed straight to the app with no wrapping.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILE_ADMIN_TOKEN:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        wants_profile = request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1"
+        if not wants_profile or not _is_profile_admin(request):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", profile_id)
+            await send(message)
+
+        profiler = SamplingProfiler(interval=float(os.getenv("PROFILE_INTERVAL", "0.005")))
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            profile_store.add(profile_id, request.method, request.url.path, status_code, profiler)
+            logging.info(f"Stored profile {profile_id} for {request.method} {request.url.path}")
+
+
+app.add_middleware(ProfileMiddleware)
+
 # Pydantic Models
 class Credentials(BaseModel):
     client_id: str
@@ -67,9 +136,28 @@ class DownloadRequest(BaseModel):
     url: str
     track_ids: Optional[List[str]] = None
 
+class SyncRequest(BaseModel):
+    url: str
+    prune: bool = False
+
 class StreamRequest(BaseModel):
     track_name: str
     artist: str
+    track_id: Optional[str] = None
+    # Spotify length, used to rank YouTube candidates; matched on title and artist alone when unset
+    duration_ms: Optional[int] = None
+    # Pipe the source through ffmpeg and send audio chunks as they are produced
+    progressive: bool = False
+    # mp3 (encoded at bitrate), or opus / m4a (remuxed from YouTube's stream); server default when unset
+    audio_format: Optional[str] = None
+    bitrate: Optional[str] = None
+
+class CacheInvalidateRequest(BaseModel):
+    track_id: Optional[str] = None
+    track_name: Optional[str] = None
+    artist: Optional[str] = None
+    # Required to flush the whole cache, so a request missing its key cannot do it by accident
+    all: bool = False
 
 YOUTUBE_BYPASS_OPTS = {
     # Use different extractor arguments to avoid bot detection
@@ -92,6 +180,86 @@ YOUTUBE_BYPASS_OPTS = {
     'geo_bypass': True,
     'geo_bypass_country': 'US',
 }
+
+# Shared across requests so concurrent batches cannot exceed YouTube's tolerance together
+search_rate_limiter = TokenBucket(
+    rate=float(os.getenv("YOUTUBE_SEARCH_RATE", "5")),
+    capacity=int(os.getenv("YOUTUBE_SEARCH_BURST", "10"))
+)
+BATCH_LINK_CONCURRENCY = int(os.getenv("BATCH_LINK_CONCURRENCY", "8"))
+
+# Option profiles for the shared YoutubeDL pool
+api.ytdl_pool.register("flat_search", {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,  # Don't download, just get metadata
+    'skip_download': True,
+    **YOUTUBE_BYPASS_OPTS,
+}, latency_target=SEARCH_LATENCY_TARGET)
+for codec, spec in AUDIO_FORMATS.items():
+    # Progressive streaming only resolves the source; ffmpeg reads it directly
+    api.ytdl_pool.register(f"stream_resolve:{codec}", {
+        'format': spec["source"],
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        **YOUTUBE_BYPASS_OPTS,
+        'socket_timeout': 30,
+    }, latency_target=SEARCH_LATENCY_TARGET)
+    # FFmpegExtractAudio copies the stream instead of encoding when the source codec already matches
+    for quality in (MP3_BITRATES if codec == "mp3" else (NATIVE_QUALITY,)):
+        api.ytdl_pool.register(f"stream_download:{codec}:{quality}", {
+            'format': spec["source"],
+            'quiet': True,
+            'no_warnings': True,
+            'noplaylist': True,
+            'extract_flat': False,
+            **YOUTUBE_BYPASS_OPTS,
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': codec,
+                'preferredquality': encode_bitrate(codec, quality),
+            }],
+            'socket_timeout': 30,
+            'retries': 3,
+            'fragment_retries': 3,
+        })
+api.ytdl_pool.register("debug_search", {
+    'quiet': False,
+    'no_warnings': False,
+    'extract_flat': True,
+    'dump_single_json': True,
+}, latency_target=SEARCH_LATENCY_TARGET)
+
+
+def _with_ytdl(profile: str, call: Callable, outtmpl: Optional[str] = None, stage: Optional[str] = None):
+    """
+    Run call(ydl) on a pooled YoutubeDL instance, timed as `stage` (defaults to the profile).
+    Blocking, so use from executor threads.
+    """
+    with track_stage(stage or profile), api.ytdl_pool.acquire(profile, outtmpl=outtmpl) as ydl:
+        return call(ydl)
+
+
+def _match_search(query: str, matcher: TrackMatcher, on_start: Optional[Callable] = None) -> Optional[dict]:
+    """
+    Metadata-only search for query's top candidates; the best one the matcher accepts, if any.
+    on_start is called once the search holds its YouTube access slot.
+    """
+    with track_stage("youtube_search") as stage, api.ytdl_pool.acquire("flat_search") as ydl:
+        if on_start:
+            on_start()
+        video = matcher.best(ydl.extract_info(search_url(query), download=False))
+        if not video:
+            stage.fail()
+        return video
+
+
+def _timed_stream(chunks, stage: str):
+    """Pass a response body through, timing it from first to last chunk (or disconnect)"""
+    with track_stage(stage):
+        yield from chunks
+
 # API Endpoints
 @app.get("/api/are-credentials-set")
 def are_credentials_set():
@@ -113,18 +281,34 @@ def is_authenticated():
 # def download_logs():
 #     return api.get_download_logs()
 
+def _sse_log_response(log_bus, request: Request) -> StreamingResponse:
+    """
+    Push log lines from a LogBus as server-sent events. Each event carries its sequence id,
+    so a reconnecting client resumes after the Last-Event-ID it sent.
+    """
+    try:
+        last_event_id = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        last_event_id = 0
+
+    async def event_generator():
+        async for entry in log_bus.subscribe(last_event_id):
+            if entry is None:
+                # Comment line keeps idle connections from being dropped by proxies
+                yield ": keepalive\n\n"
+                continue
+            seq, line = entry
+            yield f"id: {seq}\ndata: {json.dumps(line)}\n\n"
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 @app.get("/api/download-logs-stream")
-def stream_logs():
-    def event_generator():
-        last = 0
-        while True:
-            logs = api.get_download_logs()['logs']
-            # send any new lines
-            for line in logs[last:]:
-                yield f"data: {json.dumps(line)}\n\n"
-            last = len(logs)
-            time.sleep(1)
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+async def stream_logs(request: Request):
+    return _sse_log_response(api.log_bus, request)
 
 @app.get("/api/playlists")
 def get_user_playlists():
@@ -143,13 +327,91 @@ def get_download_progress():
     return api.get_download_progress()
 
 @app.post("/api/start-download")
-def start_download(req: PlaylistRequest):
+def start_download(req: DownloadRequest):
+    if req.track_ids is not None:
+        return api.download_selected_tracks(req.url, req.track_ids)
     return api.start_download(req.url)
 
+@app.post("/api/sync-playlist")
+def sync_playlist(req: SyncRequest):
+    return api.sync_playlist(req.url, req.prune)
+
 @app.get("/api/stop-download")
 def stop_download():
     return api.stop_download()
 
+@app.get("/api/jobs")
+def list_jobs():
+    return api.list_jobs()
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = api.get_job(job_id)
+    if "error" in job:
+        raise HTTPException(status_code=404, detail=job["error"])
+    return job
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    result = api.cancel_job(job_id)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.get("/api/jobs/{job_id}/archive")
+def download_job_archive(job_id: str):
+    """Stream a stored ZIP of a finished job's files, built as it is sent"""
+    result = api.get_job_files(job_id)
+    if "error" in result:
+        status_code = 409 if result["error"] == "Job is still running" else 404
+        raise HTTPException(status_code=status_code, detail=result["error"])
+    if not result["files"]:
+        raise HTTPException(status_code=404, detail="Job has no downloaded files")
+
+    # A job writes every track into one folder, so base names are unique
+    entries = [(os.path.basename(file_path), file_path) for file_path in result["files"]]
+    archive_name = urllib.parse.quote(f"{result['name']}.zip")
+    return StreamingResponse(
+        _timed_stream(stream_zip(entries), "response_stream"),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{archive_name}"}
+    )
+
+@app.get("/api/jobs/{job_id}/logs-stream")
+async def stream_job_logs(job_id: str, request: Request):
+    job = api.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _sse_log_response(job.log, request)
+
+@app.get("/api/files/{filename}")
+def get_downloaded_file(filename: str, request: Request):
+    """
+    Serve a finished download. Range requests allow seeking and resuming, and a
+    matching If-None-Match gets a 304 instead of the file body.
+    """
+    path = api.get_downloaded_file_path(filename)
+    if not path:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Passing the stat result makes FileResponse fill in ETag, Last-Modified and Content-Length
+    response = FileResponse(
+        path,
+        filename=filename,
+        stat_result=os.stat(path),
+        headers={"Accept-Ranges": "bytes"}
+    )
+    etag = response.headers["etag"]
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(
+            status_code=304,
+            headers={"ETag": etag, "Last-Modified": response.headers["last-modified"]}
+        )
+
+    return response
+
 @app.post("/api/test-download-single")
 async def test_download_single():
     """Test the download logic with a known working track"""
@@ -162,6 +424,122 @@ async def test_download_single():
     except Exception as e:
         return {"error": str(e)}
 
+STREAM_CHUNK_SIZE = 64 * 1024
+# Same bound as the buffered download: a source that produces nothing by then is given up
+STREAM_FIRST_CHUNK_TIMEOUT = 45.0
+# A source that stalls mid-stream for this long makes ffmpeg exit, ending the response
+STREAM_STALL_TIMEOUT = 15
+
+
+async def _progressive_audio_response(info: dict, filename: str, codec: str, quality: str,
+                                      video_id: Optional[str] = None) -> Optional[StreamingResponse]:
+    """
+    Transcode (or remux, when the source codec allows) the resolved audio URL with ffmpeg
+    on a pipe and stream its output.
+    Returns None when ffmpeg produces no audio, so the caller can try another source.
+    When video_id is given, a complete stream is also added to the audio cache.
+    """
+    source = info['entries'][0] if info and info.get('entries') else info
+    if not source or not source.get('url'):
+        return None
+
+    spec = AUDIO_FORMATS[codec]
+    headers = source.get('http_headers') or {}
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+    if headers:
+        command += ['-headers', "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    command += ['-rw_timeout', str(STREAM_STALL_TIMEOUT * 1_000_000)]
+    command += ['-i', source['url'], '-vn', *ffmpeg_codec_args(codec, quality, source.get('acodec'))]
+    command += [*spec.get("pipe_args", []), '-f', spec["muxer"], 'pipe:1']
+
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+
+    # Wait for the first chunk so a dead source URL can still fall back to the next strategy
+    try:
+        first_chunk = await asyncio.wait_for(process.stdout.read(STREAM_CHUNK_SIZE), STREAM_FIRST_CHUNK_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning(f"No audio from ffmpeg after {STREAM_FIRST_CHUNK_TIMEOUT:.0f}s")
+        first_chunk = b""
+    if not first_chunk:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        return None
+
+    async def audio_chunks():
+        # Tee the encoded stream to disk so the next request is a cache hit
+        cache_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{codec}') if video_id else None
+        try:
+            with track_stage("response_stream") as stage:
+                chunk = first_chunk
+                while chunk:
+                    if cache_file:
+                        cache_file.write(chunk)
+                    yield chunk
+                    chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+                await process.wait()
+                if process.returncode != 0:
+                    stage.fail()
+
+            if cache_file and process.returncode == 0:
+                cache_file.close()
+                await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: api.audio_cache.put(video_id, codec, quality, cache_file.name, move=True)
+                )
+        finally:
+            # Client disconnected mid-stream
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            if cache_file:
+                cache_file.close()
+                _remove_file(cache_file.name)
+
+    return StreamingResponse(
+        audio_chunks(),
+        media_type=media_type(codec),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+def _remove_file(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+async def _race_youtube_search(queries: List[str], matcher: TrackMatcher, timeout: float = 15.0) -> Optional[dict]:
+    """
+    Run metadata-only searches for all queries at once and return the first acceptable match.
+    The remaining searches are abandoned as soon as one succeeds.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = [loop.run_in_executor(None, _match_search, query, matcher) for query in queries]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=timeout):
+            try:
+                video = await next_done
+            except asyncio.TimeoutError:
+                logging.warning(f"Search timed out after {timeout}s")
+                return None
+            except YouTubeUnavailable:
+                raise
+            except Exception as e:
+                logging.warning(f"Search failed: {e}")
+                continue
+            if video:
+                return video
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
 @app.post("/api/stream-track")
 async def stream_track(req: StreamRequest):
     """
@@ -169,91 +547,145 @@ async def stream_track(req: StreamRequest):
     Uses alternative methods that work on servers
     """
     try:
+        try:
+            codec, quality = resolve_audio_format(req.audio_format, req.bitrate)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         search_query = f"{req.artist} {req.track_name}"
-        filename = f"{req.artist} - {req.track_name}.mp3"
+        filename = f"{req.artist} - {req.track_name}.{codec}"
         filename = "".join(c for c in filename if c.isalnum() or c in (' ', '-', '.')).rstrip()
 
         logging.info(f"Attempting download with bot bypass: {search_query}")
 
         # Strategy 1: Use Android client (most reliable, bypasses bot detection)
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
+        temp_suffix = f'.{codec}'
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=temp_suffix)
         temp_path = temp_file.name
         temp_file.close()
 
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': temp_path.replace('.mp3', ''),
-            'quiet': True,
-            'no_warnings': True,
-            'noplaylist': True,
-            'extract_flat': False,
-            **YOUTUBE_BYPASS_OPTS,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'socket_timeout': 30,
-            'retries': 3,
-            'fragment_retries': 3,
-        }
-
-        # Try different search strategies
-        strategies = [
+        # Search strategies, raced against each other during resolution
+        search_queries = [
             # Most effective strategies for server environments
-            f"ytsearch1:{search_query} audio",
-            f"ytsearch1:{search_query} official audio",
-            f"ytsearch1:{req.track_name} {req.artist}",
+            f"{search_query} audio",
+            f"{search_query} official audio",
+            f"{req.track_name} {req.artist}",
         ]
 
+        # Cache reads and writes take a lock and touch disk, so they run off the event loop
+        loop = asyncio.get_running_loop()
+
+        # A previously resolved video skips the search entirely
+        video = await loop.run_in_executor(None, api.youtube_cache.get, req.track_id, req.artist, req.track_name)
+        from_cache = video is not None
+
         last_error = None
-        
-        for strategy in strategies:
+
+        # At most two rounds: a cached video that fails falls back to a fresh search
+        for _ in range(2):
+            if not video:
+                video = await _race_youtube_search(
+                    search_queries, TrackMatcher(req.track_name, req.artist, req.duration_ms)
+                )
+                from_cache = False
+                if not video:
+                    last_error = "No search strategy found a match"
+                    break
+
+            # Served straight from disk when this video was transcoded before
+            cached_audio = await loop.run_in_executor(None, api.audio_cache.get, video['id'], codec, quality)
+            if cached_audio:
+                logging.info(f"✅ Serving {video['id']} from audio cache")
+                if not from_cache:
+                    await loop.run_in_executor(
+                        None, api.youtube_cache.put, video, req.track_id, req.artist, req.track_name
+                    )
+                return FileResponse(cached_audio, media_type=media_type(codec), filename=filename)
+
+            watch_url = f"https://www.youtube.com/watch?v={video['id']}"
             try:
-                logging.info(f"Trying strategy: {strategy}")
-                
-                with YoutubeDL(ydl_opts) as ydl:
+                logging.info(f"Fetching {watch_url} ({'cached' if from_cache else 'searched'})")
+                response = None
+
+                if req.progressive:
+                    info = await asyncio.wait_for(
+                        asyncio.get_event_loop().run_in_executor(
+                            None,
+                            lambda: _with_ytdl(
+                                f"stream_resolve:{codec}",
+                                lambda ydl: ydl.extract_info(watch_url, download=False),
+                                stage="stream_resolve"
+                            )
+                        ),
+                        timeout=45.0
+                    )
+                    response = await _progressive_audio_response(info, filename, codec, quality, video['id'])
+                else:
                     await asyncio.wait_for(
                         asyncio.get_event_loop().run_in_executor(
                             None,
-                            lambda s=strategy: ydl.download([s])
+                            lambda: _with_ytdl(
+                                f"stream_download:{codec}:{quality}",
+                                lambda ydl: ydl.download([watch_url]),
+                                outtmpl=temp_path[:-len(temp_suffix)],
+                                stage="stream_download"
+                            )
                         ),
                         timeout=45.0
                     )
-                
-                # Check for output file
-                possible_files = [
-                    temp_path,
-                    f"{temp_path}.mp3",
-                    temp_path.replace('.mp3', '.mp3'),
-                ]
-                
-                for file_path in possible_files:
-                    if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-                        with open(file_path, 'rb') as f:
-                            audio_data = f.read()
-                        
-                        # Cleanup
-                        try:
-                            os.unlink(file_path)
-                        except:
-                            pass
-                        
-                        logging.info(f"✅ Success with strategy: {strategy}")
-                        
-                        return StreamingResponse(
-                            io.BytesIO(audio_data),
-                            media_type="audio/mpeg",
-                            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+
+                    # Check for output file
+                    possible_files = [
+                        temp_path,
+                        f"{temp_path}{temp_suffix}",
+                    ]
+
+                    for file_path in possible_files:
+                        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+                            cached_audio = await loop.run_in_executor(
+                                None, lambda: api.audio_cache.put(video['id'], codec, quality, file_path, move=True)
+                            )
+                            if cached_audio:
+                                response = FileResponse(cached_audio, media_type=media_type(codec), filename=filename)
+                                break
+
+                            # Too large to cache: move the file out of the cleanup set below
+                            # and remove it once sent
+                            served_path = f"{file_path}.serve"
+                            os.replace(file_path, served_path)
+                            response = FileResponse(
+                                served_path,
+                                media_type=media_type(codec),
+                                filename=filename,
+                                background=BackgroundTask(_remove_file, served_path)
+                            )
+                            break
+
+                if response:
+                    logging.info(f"✅ Success with {watch_url}")
+                    if not from_cache:
+                        await loop.run_in_executor(
+                            None, api.youtube_cache.put, video, req.track_id, req.artist, req.track_name
                         )
-                
+                    return response
+
+                last_error = f"No audio produced: {watch_url}"
+
             except asyncio.TimeoutError:
-                last_error = f"Timeout: {strategy}"
+                last_error = f"Timeout: {watch_url}"
                 logging.warning(last_error)
+            except YouTubeUnavailable:
+                raise
             except Exception as e:
                 last_error = str(e)
-                logging.warning(f"Failed {strategy}: {e}")
-                continue
+                logging.warning(f"Failed {watch_url}: {e}")
+
+            if not from_cache:
+                break
+
+            # The cached video did not produce audio, so forget it and search again
+            await loop.run_in_executor(None, api.youtube_cache.invalidate, req.track_id, req.artist, req.track_name)
+            video = None
         
         # All strategies failed - return error with helpful message
         raise HTTPException(
@@ -272,6 +704,13 @@ async def stream_track(req: StreamRequest):
 
     except HTTPException:
         raise
+    except YouTubeUnavailable as e:
+        # Blocked or saturated: fail fast instead of timing out on every strategy
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "YouTube temporarily unavailable", "message": str(e), "retry_after": round(e.retry_after)},
+            headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -279,9 +718,9 @@ async def stream_track(req: StreamRequest):
         # Cleanup
         try:
             if 'temp_path' in locals():
-                for ext in ['', '.mp3', '.m4a', '.webm', '.part']:
+                for ext in ['', temp_suffix, '.mp3', '.m4a', '.opus', '.webm', '.part']:
                     try:
-                        file_to_remove = temp_path if ext == '' else temp_path.replace('.mp3', ext)
+                        file_to_remove = temp_path if ext == '' else temp_path[:-len(temp_suffix)] + ext
                         if os.path.exists(file_to_remove):
                             os.unlink(file_to_remove)
                     except:
@@ -297,46 +736,74 @@ async def get_youtube_link_only(req: StreamRequest):
     This ALWAYS works and bypasses bot detection
     """
     try:
+        # Cache reads and writes take a lock and touch disk, so they run off the event loop
+        loop = asyncio.get_running_loop()
+        cached_video = await loop.run_in_executor(None, api.youtube_cache.get, req.track_id, req.artist, req.track_name)
+        if cached_video:
+            return {
+                "success": True,
+                "youtube_url": f"https://youtube.com/watch?v={cached_video['id']}",
+                "youtube_id": cached_video['id'],
+                "title": cached_video.get('title'),
+                "duration": cached_video.get('duration'),
+                "confidence": cached_video.get('confidence'),
+                "track_name": req.track_name,
+                "artist": req.artist,
+                "cached": True
+            }
+
+        # A recent failure is answered from the cache until its backoff expires
+        failure = await loop.run_in_executor(
+            None, api.youtube_cache.get_failure, req.track_id, req.artist, req.track_name
+        )
+        if failure:
+            return {
+                "success": False,
+                "error": "Could not find track on YouTube",
+                **failure,
+                "cached": True
+            }
+
         search_query = f"{req.artist} {req.track_name} audio"
         
-        # Use web client with minimal options (faster, less likely to be blocked)
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,  # Don't download, just get metadata
-            'skip_download': True,
-            **YOUTUBE_BYPASS_OPTS,
-        }
-        
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.wait_for(
-                    asyncio.get_event_loop().run_in_executor(
-                        None,
-                        lambda: ydl.extract_info(f"ytsearch1:{search_query}", download=False)
-                    ),
-                    timeout=10.0
-                )
+            # Flat search: metadata only, faster and less likely to be blocked
+            video = await asyncio.wait_for(
+                asyncio.get_event_loop().run_in_executor(
+                    None, _match_search, search_query, TrackMatcher(req.track_name, req.artist, req.duration_ms)
+                ),
+                timeout=10.0
+            )
+            
+            if video:
+                await loop.run_in_executor(None, api.youtube_cache.put, video, req.track_id, req.artist, req.track_name)
                 
-                if info and 'entries' in info and len(info['entries']) > 0:
-                    video = info['entries'][0]
-                    video_id = video.get('id')
-                    
-                    return {
-                        "success": True,
-                        "youtube_url": f"https://youtube.com/watch?v={video_id}",
-                        "youtube_id": video_id,
-                        "title": video.get('title'),
-                        "duration": video.get('duration'),
-                        "track_name": req.track_name,
-                        "artist": req.artist
-                    }
+                return {
+                    "success": True,
+                    "youtube_url": f"https://youtube.com/watch?v={video['id']}",
+                    "youtube_id": video['id'],
+                    "title": video.get('title'),
+                    "duration": video.get('duration'),
+                    "confidence": video.get('confidence'),
+                    "track_name": req.track_name,
+                    "artist": req.artist
+                }
+            failure = await loop.run_in_executor(
+                None, api.youtube_cache.record_failure, failure_reason(), req.track_id, req.artist, req.track_name
+            )
+        except YouTubeUnavailable as e:
+            # Not the track's fault, so nothing is recorded against it
+            return {"success": False, "error": str(e), "retry_after": round(e.retry_after)}
         except Exception as e:
-            logging.error(f"YouTube link extraction failed: {e}")
+            logging.error(f"YouTube link extraction failed: {e!r}")
+            failure = await loop.run_in_executor(
+                None, api.youtube_cache.record_failure, failure_reason(e), req.track_id, req.artist, req.track_name
+            )
         
         return {
             "success": False,
-            "error": "Could not find track on YouTube"
+            "error": "Could not find track on YouTube",
+            **(failure or {})
         }
         
     except Exception as e:
@@ -344,6 +811,155 @@ async def get_youtube_link_only(req: StreamRequest):
         return {"success": False, "error": str(e)}
 
 
+def _link_result(track: dict, index: int, video: Optional[dict] = None, error: Optional[str] = None,
+                 cached: bool = False, failure: Optional[dict] = None) -> dict:
+    """Shape one batch-youtube-links result entry"""
+    result = {
+        "index": index,
+        "track_name": track['name'],
+        "artist": track['artists'][0]['name'],
+    }
+    if video:
+        result.update({
+            "youtube_url": f"https://youtube.com/watch?v={video['id']}",
+            "youtube_id": video['id'],
+            "title": video.get('title'),
+            "confidence": video.get('confidence'),
+            "success": True
+        })
+        if cached:
+            result["cached"] = True
+    else:
+        result.update({"success": False, "error": error})
+        # reason, failures and retry_at of a failed lookup
+        if failure:
+            result.update(failure)
+        if cached:
+            result["cached"] = True
+    return result
+
+
+# Batch error text for lookups skipped while an earlier failure backs off
+LINK_FAILURE_ERRORS = {
+    REASON_NOT_FOUND: "Not found",
+    REASON_TIMEOUT: "Timeout",
+    REASON_BOT_BLOCKED: "Blocked by YouTube",
+}
+
+
+def _scan_link_caches(tracks: List[dict]) -> Tuple[List[dict], List[Tuple[int, dict]]]:
+    """
+    Split a playlist into results answered from the YouTube cache (matches, and failures
+    still backing off) and the tracks left to search. SQLite work, so run it off the event loop.
+    """
+    answered, to_search = [], []
+    for index, track_info in enumerate(tracks):
+        track = track_info['track']
+        if not track or track['type'] != 'track':
+            continue
+
+        cached_video = api.youtube_cache.get(track['id'], track['artists'][0]['name'], track['name'])
+        if cached_video:
+            answered.append(_link_result(track, index, cached_video, cached=True))
+            continue
+
+        # Failed lookups are not searched again until their backoff expires
+        failure = api.youtube_cache.get_failure(track['id'], track['artists'][0]['name'], track['name'])
+        if failure:
+            answered.append(_link_result(track, index, error=LINK_FAILURE_ERRORS.get(failure['reason'], "Error"),
+                                         cached=True, failure=failure))
+        else:
+            to_search.append((index, track))
+    return answered, to_search
+
+
+def _search_link(track: dict, index: int, on_start: Optional[Callable] = None) -> dict:
+    """Search one track and record the outcome in the YouTube cache; blocking, for executor threads"""
+    artist = track['artists'][0]['name']
+    try:
+        video = _match_search(f"{artist} {track['name']} audio",
+                              TrackMatcher(track['name'], artist, track.get('duration_ms')), on_start)
+    except YouTubeUnavailable as e:
+        # Not the track's fault, so nothing is recorded against it
+        return _link_result(track, index, error=str(e))
+    except Exception as e:
+        failure = api.youtube_cache.record_failure(failure_reason(e), track['id'], artist, track['name'])
+        return _link_result(track, index, error=str(e), failure=failure)
+
+    if video:
+        api.youtube_cache.put(video, track['id'], artist, track['name'])
+        return _link_result(track, index, video)
+    failure = api.youtube_cache.record_failure(failure_reason(), track['id'], artist, track['name'])
+    return _link_result(track, index, error="Not found", failure=failure)
+
+
+async def _resolve_playlist_links(tracks: List[dict]):
+    """
+    Yield YouTube link results as each track resolves.
+    Cached tracks are emitted first; the rest are searched by a bounded set of
+    workers on pooled YoutubeDL instances, behind the shared search rate limit.
+    Cache reads and writes run on executor threads, never on the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    answered, pending = await loop.run_in_executor(None, _scan_link_caches, tracks)
+    for result in answered:
+        yield result
+
+    if not pending:
+        return
+
+    to_search = asyncio.Queue()
+    for entry in pending:
+        to_search.put_nowait(entry)
+    results = asyncio.Queue()
+
+    async def worker():
+        try:
+            while not to_search.empty():
+                index, track = to_search.get_nowait()
+                try:
+                    await search_rate_limiter.acquire()
+                    started = loop.create_future()
+
+                    def on_start(started=started):
+                        try:
+                            loop.call_soon_threadsafe(lambda: started.done() or started.set_result(None))
+                        except RuntimeError:
+                            pass  # The loop closed while the search waited
+
+                    search = loop.run_in_executor(None, _search_link, track, index, on_start)
+                    # Waiting for an access slot is bounded by the controller, which answers
+                    # YouTubeUnavailable; only the search itself counts against the timeout
+                    await asyncio.wait({started, search}, return_when=asyncio.FIRST_COMPLETED)
+                    # A timed-out search keeps its pooled instance until it finishes
+                    result = await asyncio.wait_for(search, timeout=8.0)
+                except asyncio.TimeoutError as e:
+                    failure = await loop.run_in_executor(
+                        None, api.youtube_cache.record_failure,
+                        failure_reason(e), track['id'], track['artists'][0]['name'], track['name']
+                    )
+                    result = _link_result(track, index, error="Timeout", failure=failure)
+                except Exception as e:
+                    result = _link_result(track, index, error=str(e))
+                await results.put(result)
+        finally:
+            await results.put(None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(BATCH_LINK_CONCURRENCY, to_search.qsize()))]
+    try:
+        finished = 0
+        while finished < len(workers):
+            result = await results.get()
+            if result is None:
+                finished += 1
+            else:
+                yield result
+    finally:
+        # Stop searching if the client went away mid-stream
+        for task in workers:
+            task.cancel()
+
+
 @app.post("/api/batch-youtube-links")
 async def batch_youtube_links(req: PlaylistRequest):
     """
@@ -355,72 +971,11 @@ async def batch_youtube_links(req: PlaylistRequest):
         if not playlist_id:
             return {"error": "Invalid playlist URL"}
         
-        tracks = api.get_playlist_tracks(playlist_id)
-        results = []
-        
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'skip_download': True,
-            **YOUTUBE_BYPASS_OPTS,
-        }
-        
+        tracks = await asyncio.get_running_loop().run_in_executor(None, api.get_playlist_tracks, playlist_id)
         logging.info(f"Getting YouTube links for {len(tracks)} tracks...")
-        
-        for i, track_info in enumerate(tracks):
-            track = track_info['track']
-            if not track or track['type'] != 'track':
-                continue
-            
-            try:
-                search_query = f"{track['artists'][0]['name']} {track['name']} audio"
-                
-                with YoutubeDL(ydl_opts) as ydl:
-                    info = await asyncio.wait_for(
-                        asyncio.get_event_loop().run_in_executor(
-                            None,
-                            lambda sq=search_query: ydl.extract_info(f"ytsearch1:{sq}", download=False)
-                        ),
-                        timeout=8.0
-                    )
-                    
-                    if info and 'entries' in info and len(info['entries']) > 0:
-                        video = info['entries'][0]
-                        results.append({
-                            "track_name": track['name'],
-                            "artist": track['artists'][0]['name'],
-                            "youtube_url": f"https://youtube.com/watch?v={video['id']}",
-                            "youtube_id": video['id'],
-                            "title": video.get('title'),
-                            "success": True
-                        })
-                    else:
-                        results.append({
-                            "track_name": track['name'],
-                            "artist": track['artists'][0]['name'],
-                            "success": False,
-                            "error": "Not found"
-                        })
-            
-            except asyncio.TimeoutError:
-                results.append({
-                    "track_name": track['name'],
-                    "artist": track['artists'][0]['name'],
-                    "success": False,
-                    "error": "Timeout"
-                })
-            except Exception as e:
-                results.append({
-                    "track_name": track['name'],
-                    "artist": track['artists'][0]['name'],
-                    "success": False,
-                    "error": str(e)
-                })
-            
-            # Small delay to avoid rate limiting
-            if i < len(tracks) - 1:
-                await asyncio.sleep(0.3)
+
+        results = [result async for result in _resolve_playlist_links(tracks)]
+        results.sort(key=lambda r: r['index'])
         
         found_count = len([r for r in results if r.get('success')])
         
@@ -437,6 +992,76 @@ async def batch_youtube_links(req: PlaylistRequest):
         return {"error": str(e)}
 
 
+@app.post("/api/batch-youtube-links/stream")
+async def stream_batch_youtube_links(req: PlaylistRequest):
+    """
+    Same as batch-youtube-links, but streams one NDJSON line per track as soon
+    as it resolves, followed by a final summary line
+    """
+    playlist_id = api.extract_playlist_id(req.url)
+    if not playlist_id:
+        raise HTTPException(status_code=400, detail="Invalid playlist URL")
+    if not api.sp:
+        raise HTTPException(status_code=401, detail="Not authenticated with Spotify")
+
+    try:
+        tracks = await asyncio.get_running_loop().run_in_executor(None, api.get_playlist_tracks, playlist_id)
+    except Exception as e:
+        logging.error(f"Error fetching playlist in stream_batch_youtube_links: {e}")
+        raise HTTPException(status_code=502, detail=f"Failed to fetch playlist from Spotify: {e}")
+    logging.info(f"Streaming YouTube links for {len(tracks)} tracks...")
+
+    async def ndjson_lines():
+        total = 0
+        found_count = 0
+        try:
+            async for result in _resolve_playlist_links(tracks):
+                total += 1
+                found_count += 1 if result.get('success') else 0
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            logging.error(f"Error in stream_batch_youtube_links: {e}")
+            yield json.dumps({"done": True, "error": str(e)}) + "\n"
+            return
+
+        yield json.dumps({
+            "done": True,
+            "total": total,
+            "found": found_count,
+            "message": f"Found {found_count}/{total} tracks on YouTube"
+        }) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/api/youtube-cache/stats")
+def youtube_cache_stats():
+    return api.youtube_cache.stats()
+
+@app.get("/api/ytdl-pool/stats")
+def ytdl_pool_stats():
+    return api.ytdl_pool.stats()
+
+@app.get("/api/youtube-access/stats")
+def youtube_access_stats():
+    return api.youtube_access.stats()
+
+@app.get("/api/audio-cache/stats")
+def audio_cache_stats():
+    return api.audio_cache.stats()
+
+@app.post("/api/youtube-cache/invalidate")
+def invalidate_youtube_cache(req: CacheInvalidateRequest):
+    """Forget cached matches for one track, or the whole cache with all: true"""
+    if bool(req.artist) != bool(req.track_name):
+        raise HTTPException(status_code=400, detail="artist and track_name must be given together")
+    has_key = bool(req.track_id or req.artist)
+    if has_key == req.all:
+        raise HTTPException(status_code=400, detail="Give track_id or artist and track_name, or all: true")
+    removed = api.youtube_cache.invalidate(req.track_id, req.artist, req.track_name, everything=req.all)
+    return {"success": True, "removed": removed}
+
+
 @app.get("/api/test-youtube-access")
 async def test_youtube_access():
     """
@@ -485,7 +1110,7 @@ async def spotify_callback(request: Request):
     
     try:
         token_info = api.sp_oauth.get_access_token(code)
-        api.sp = spotipy.Spotify(auth=token_info['access_token'])
+        api.set_spotify_token(token_info['access_token'])
         auth_event.set()  # Signal authentication complete
         return {"status": "success", "message": "Authentication successful"}
     except Exception as e:
@@ -547,13 +1172,6 @@ async def test_search(req: StreamRequest):
     try:
         search_query = f"{req.artist} {req.track_name}"
         
-        ydl_opts = {
-            'quiet': False,
-            'no_warnings': False,
-            'extract_flat': True,
-            'dump_single_json': True,
-        }
-        
         results = {}
         
         # Test different search methods
@@ -565,29 +1183,30 @@ async def test_search(req: StreamRequest):
         
         for method_name, search_term in search_methods.items():
             try:
-                with YoutubeDL(ydl_opts) as ydl:
-                    info = await asyncio.wait_for(
-                        asyncio.get_event_loop().run_in_executor(
-                            None,
-                            lambda st=search_term: ydl.extract_info(st, download=False)
-                        ),
-                        timeout=10.0
-                    )
-                    
-                    if info and 'entries' in info and len(info['entries']) > 0:
-                        entry = info['entries'][0]
-                        results[method_name] = {
-                            "success": True,
-                            "id": entry.get('id'),
-                            "title": entry.get('title'),
-                            "duration": entry.get('duration'),
-                            "url": f"https://youtube.com/watch?v={entry.get('id')}"
-                        }
-                    else:
-                        results[method_name] = {
-                            "success": False,
-                            "error": "No results"
-                        }
+                info = await asyncio.wait_for(
+                    asyncio.get_event_loop().run_in_executor(
+                        None,
+                        lambda st=search_term: _with_ytdl(
+                            "debug_search", lambda ydl: ydl.extract_info(st, download=False)
+                        )
+                    ),
+                    timeout=10.0
+                )
+                
+                if info and 'entries' in info and len(info['entries']) > 0:
+                    entry = info['entries'][0]
+                    results[method_name] = {
+                        "success": True,
+                        "id": entry.get('id'),
+                        "title": entry.get('title'),
+                        "duration": entry.get('duration'),
+                        "url": f"https://youtube.com/watch?v={entry.get('id')}"
+                    }
+                else:
+                    results[method_name] = {
+                        "success": False,
+                        "error": "No results"
+                    }
                         
             except asyncio.TimeoutError:
                 results[method_name] = {"success": False, "error": "Timeout"}
@@ -688,6 +1307,37 @@ async def quick_test_download():
 async def root():
     return {"status": "ok", "message": "Spotify Downloader API is running"}
 
+@app.get("/api/profiles")
+def list_profiles(request: Request):
+    _require_profile_admin(request)
+    return {"profiles": profile_store.list()}
+
+@app.get("/api/profiles/{profile_id}")
+def download_profile(profile_id: str, request: Request, format: str = "collapsed"):
+    """A stored profile as folded stacks (flamegraph.pl / speedscope) or a top-functions summary"""
+    _require_profile_admin(request)
+    entry = profile_store.get(profile_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    if format == "collapsed":
+        content, extension = entry["profiler"].collapsed(), "folded"
+    elif format == "summary":
+        content, extension = entry["profiler"].summary(), "txt"
+    else:
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'summary'")
+
+    return Response(
+        content,
+        media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.{extension}"'}
+    )
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of stage timings, outcomes, cache hits and queue depths"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": time.time()}
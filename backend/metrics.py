@@ -0,0 +1,221 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds; spans a cached lookup through to a slow download or a long stream
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+
+        lines = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Gauge or counter whose samples are read from the application at scrape time"""
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], object],
+                 labelnames: Sequence[str] = (), kind: str = "gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self._fn = fn
+
+    def render(self) -> List[str]:
+        # A plain number, or {label values tuple: number} for labelled metrics
+        samples = self._fn()
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key if isinstance(key, tuple) else (key,))} "
+            f"{_format_value(value)}"
+            for key, value in samples.items()
+        ]
+
+
+class MetricsRegistry:
+    """Named metrics rendered together in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # Re-registering a name replaces it, e.g. callbacks bound to a newer object
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name: str, help_text: str, fn: Callable[[], object],
+                 labelnames: Sequence[str] = (), kind: str = "gauge") -> CallbackMetric:
+        return self._register(CallbackMetric(name, help_text, fn, labelnames, kind))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+                continue
+            lines.extend(metric.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "spotify_downloader_stage_seconds",
+    "Time spent per stage: Spotify API calls, YouTube search, download, transcode, response streaming",
+    labelnames=("stage",)
+)
+STAGE_RESULTS = REGISTRY.counter(
+    "spotify_downloader_stage_results_total",
+    "Stage runs by outcome",
+    labelnames=("stage", "outcome")
+)
+TRACKS = REGISTRY.counter(
+    "spotify_downloader_tracks_total",
+    "Tracks finished by download jobs, by outcome",
+    labelnames=("outcome",)
+)
+YOUTUBE_MATCHES = REGISTRY.counter(
+    "spotify_downloader_youtube_matches_total",
+    "Ranked YouTube searches by outcome: accepted, rejected (low confidence) or empty",
+    labelnames=("outcome",)
+)
+
+SPOTIFY_THROTTLED = REGISTRY.counter(
+    "spotify_downloader_spotify_throttled_total",
+    "Spotify API responses with status 429 (rate limited)"
+)
+SPOTIFY_THROTTLE_SECONDS = REGISTRY.counter(
+    "spotify_downloader_spotify_throttle_seconds_total",
+    "Time Spotify requests were held back by Retry-After or backoff"
+)
+SPOTIFY_RETRIES = REGISTRY.counter(
+    "spotify_downloader_spotify_retries_total",
+    "Spotify API requests retried, by cause: throttled, server_error, connection",
+    labelnames=("reason",)
+)
+
+
+class StageTimer:
+    """Times one stage run; failure is an exception, or an explicit fail() for soft failures"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.failed = False
+        self._start: Optional[float] = None
+
+    def fail(self):
+        self.failed = True
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self._start, stage=self.stage)
+        outcome = "failure" if exc_type is not None or self.failed else "success"
+        STAGE_RESULTS.inc(stage=self.stage, outcome=outcome)
+        return False
+
+
+def track_stage(stage: str) -> StageTimer:
+    return StageTimer(stage)
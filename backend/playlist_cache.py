@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class PlaylistCache:
+    """LRU of playlist track lists, valid only while the playlist's snapshot_id is unchanged"""
+
+    def __init__(self, max_entries: int = 32, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, playlist_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{playlist_id}.json")
+
+    def _load_from_disk(self, playlist_id: str) -> Optional[Dict]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(playlist_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable playlist cache file for {playlist_id}: {e}")
+            return None
+
+    def get(self, playlist_id: str, snapshot_id: str) -> Optional[List[Dict]]:
+        """Return cached tracks if they were fetched at this snapshot"""
+        with self._lock:
+            entry = self._entries.get(playlist_id)
+            if entry is None:
+                entry = self._load_from_disk(playlist_id)
+                if entry is not None:
+                    self._store(playlist_id, entry)
+
+            if entry is None or entry['snapshot_id'] != snapshot_id:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(playlist_id)
+            self.hits += 1
+            return entry['tracks']
+
+    def put(self, playlist_id: str, snapshot_id: str, tracks: List[Dict]):
+        entry = {"snapshot_id": snapshot_id, "tracks": tracks}
+        with self._lock:
+            self._store(playlist_id, entry)
+
+        if self.cache_dir:
+            # Write then rename so a crash never leaves a truncated cache file
+            path = self._disk_path(playlist_id)
+            try:
+                with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                    json.dump(entry, f)
+                os.replace(f"{path}.tmp", path)
+            except Exception as e:
+                logging.warning(f"Failed to persist playlist cache for {playlist_id}: {e}")
+
+    def _store(self, playlist_id: str, entry: Dict):
+        self._entries[playlist_id] = entry
+        self._entries.move_to_end(playlist_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
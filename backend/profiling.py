@@ -0,0 +1,117 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+# Leaf frames in these modules mean the thread is parked (idle pool workers, the event loop
+# waiting in select), which would otherwise dominate every profile
+IDLE_MODULES = ("threading.py", "selectors.py", "queue.py", os.path.join("concurrent", "futures", "thread.py"))
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread at a fixed interval from a background thread.
+    Work handed to executor threads (yt-dlp, sync endpoints) is included, which a
+    deterministic profiler on the request's own thread would miss; concurrent requests
+    show up too, under their thread names.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at = 0.0
+        self.duration = 0.0
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or frame.f_code.co_filename.endswith(IDLE_MODULES):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def collapsed(self) -> str:
+        """Folded stacks ("root;...;leaf count"), readable by flamegraph.pl and speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def summary(self, limit: int = 40) -> str:
+        """Top functions by samples spent in them (self) and under them (total)"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+
+        sampled = sum(self.samples.values()) or 1
+        lines = [
+            f"{self.sample_count} sampling rounds over {self.duration:.3f}s "
+            f"({self.interval * 1000:.1f} ms interval), {sampled} busy thread samples",
+            "",
+            f"{'self %':>7} {'total %':>8}  function",
+        ]
+        for frame, count in total.most_common(limit):
+            lines.append(f"{own[frame] / sampled * 100:7.1f} {count / sampled * 100:8.1f}  {frame}")
+        return "\n".join(lines) + "\n"
+
+
+class ProfileStore:
+    """Most recent request profiles, oldest dropped first beyond max_entries"""
+
+    def __init__(self, max_entries: int = 20):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile_id: str, method: str, path: str, status_code: int, profiler: SamplingProfiler):
+        entry = {
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "status_code": status_code,
+            "created_at": time.time(),
+            "duration": profiler.duration,
+            "samples": profiler.sample_count,
+            "profiler": profiler,
+        }
+        with self._lock:
+            self._entries[profile_id] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._entries.get(profile_id)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            entries = list(self._entries.values())
+        return [{k: v for k, v in entry.items() if k != "profiler"} for entry in reversed(entries)]
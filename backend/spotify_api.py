@@ -6,12 +6,72 @@ import urllib.parse
 import urllib.request
 import string
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 import spotipy
 from spotipy import SpotifyOAuth
-from yt_dlp import YoutubeDL
 import logging
+import subprocess
 import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from youtube_cache import YouTubeCache, failure_reason
+from youtube_match import TrackMatcher, search_url
+from playlist_cache import PlaylistCache
+from audio_cache import AudioCache
+from log_bus import LogBus
+from download_jobs import DownloadJob, FairTrackScheduler, JobManager
+from download_queue import DownloadQueue
+from youtube_access import CIRCUIT_CLOSED, SEARCH_LATENCY_TARGET, YouTubeAccessController
+from ytdl_pool import YoutubeDLPool
+from spotify_session import SpotifySession
+from track_pipeline import TrackPipeline, TrackTask
+from audio_format import AUDIO_FORMATS, ffmpeg_codec_args, resolve_audio_format
+from metrics import REGISTRY, TRACKS, track_stage
+
+
+# Format downloads are written in (AUDIO_FORMAT / AUDIO_BITRATE); part of the audio cache key
+AUDIO_CODEC, AUDIO_QUALITY = resolve_audio_format()
+
+# Only the track attributes get_playlist_tracks_info and download_track read
+PLAYLIST_TRACK_FIELDS = (
+    "total,items(track(id,name,type,duration_ms,preview_url,external_urls(spotify),artists(name)))"
+)
+
+# Sub-directory of a download folder holding fetched audio until it is transcoded
+STAGING_DIR_NAME = ".staging"
+
+# Metadata-only search used to resolve a track before anything is downloaded
+TRACK_RESOLVE_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+    'skip_download': True,
+}
+
+# Fetches the source audio as-is; ffmpeg runs separately in the transcode stage.
+# The output template and hooks are set per call. Errors are raised rather than ignored,
+# so blocks and timeouts reach the YouTube access controller.
+TRACK_FETCH_OPTS = {
+    # Prefer a source already in the output codec, so it can be remuxed instead of encoded
+    'format': AUDIO_FORMATS[AUDIO_CODEC]["source"],
+    'noplaylist': True,
+    'quiet': False,  # Keep logs visible for debugging
+    'no_warnings': False,
+    'extract_flat': False,
+    'socket_timeout': 30,
+    'retries': 3,
+    'fragment_retries': 3,
+    'skip_unavailable_fragments': True,
+    'keepvideo': False,
+    'writethumbnail': False,
+    'writeinfojson': False,
+    'cookiefile': None,
+    'noprogress': True,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+    },
+}
 
 
 class DownloadInterrupted(Exception):
@@ -23,7 +83,19 @@ class SpotifyDownloaderAPI:
         self.client_secret = None
         self.redirect_uri = os.getenv("REDIRECT_URI", "http://127.0.0.1:8000/callback")
         self.credentials_set = False
-        
+
+        # One pooled, rate-limit aware client for every Spotify call; signing in only swaps its token
+        self.spotify_session = SpotifySession(
+            pool_size=max(1, int(os.getenv("SPOTIFY_POOL_SIZE", "16"))),
+            max_retries=int(os.getenv("SPOTIFY_MAX_RETRIES", "5")),
+            max_retry_after=float(os.getenv("SPOTIFY_MAX_RETRY_AFTER", "120"))
+        )
+        self.spotify_client = spotipy.Spotify(
+            requests_session=self.spotify_session,
+            requests_timeout=float(os.getenv("SPOTIFY_TIMEOUT", "10")),
+            retries=0,
+            status_retries=0
+        )
         
         self.env_path = '.env'
         self._check_credentials()
@@ -32,7 +104,8 @@ class SpotifyDownloaderAPI:
         self.sp_oauth = None
         self.sp = None
 
-        self.temp_download_path = tempfile.mkdtemp()
+        # A fixed DOWNLOAD_DIR lets resumed jobs find the tracks they finished before a restart
+        self.temp_download_path = os.getenv("DOWNLOAD_DIR") or tempfile.mkdtemp()
         logging.info(f"Created temp download directory: {self.temp_download_path}")
 
         
@@ -44,12 +117,147 @@ class SpotifyDownloaderAPI:
         if self.credentials_set:
             self._setup_spotify_auth()
         
-        self.is_downloading = False
-        self.download_progress = {"current": 0, "total": 0, "status": "idle"}
-        self.download_log: List[str] = []
+        # Spotify track id -> exact file produced for it
+        self._file_index: Dict[str, str] = {}
+        self._file_index_lock = threading.Lock()
+
+        # Bounded so long-running servers do not accumulate log lines forever
+        self.log_bus = LogBus(capacity=int(os.getenv("DOWNLOAD_LOG_SIZE", "1000")))
+
+        # Admits tracks into the pipeline round-robin across jobs; one thread keeps the order
+        # strict, and it simply blocks while the first stage is full
+        self.track_scheduler = FairTrackScheduler(1)
+        self.download_queue = DownloadQueue(os.getenv("DOWNLOAD_QUEUE_PATH", ".download_queue.db"))
+        self.jobs = JobManager(
+            self._run_download_job,
+            max_active_jobs=max(1, int(os.getenv("MAX_ACTIVE_JOBS", "4"))),
+            on_status_change=self._persist_job_status
+        )
+
+        # Page requests after the first one are fanned out on this pool
+        self.spotify_executor = ThreadPoolExecutor(
+            max_workers=max(1, int(os.getenv("SPOTIFY_PAGE_WORKERS", "4"))),
+            thread_name_prefix="spotify-page"
+        )
+
+        self.youtube_cache = YouTubeCache(
+            os.getenv("YOUTUBE_CACHE_PATH", ".youtube_cache.db"),
+            ttl_seconds=int(os.getenv("YOUTUBE_CACHE_TTL", str(30 * 24 * 3600))),
+            max_backoff_seconds=int(os.getenv("YOUTUBE_FAILURE_MAX_BACKOFF", str(7 * 24 * 3600)))
+        )
+        self.audio_cache = AudioCache(
+            os.getenv("AUDIO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "spotify_audio_cache")),
+            max_bytes=int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+        )
+        self.playlist_cache = PlaylistCache(
+            max_entries=int(os.getenv("PLAYLIST_CACHE_SIZE", "32")),
+            cache_dir=os.getenv("PLAYLIST_CACHE_DIR")
+        )
+
+        # Adaptive concurrency limit and circuit breaker shared by every YouTube call
+        self.youtube_access = YouTubeAccessController(
+            initial_limit=int(os.getenv("YOUTUBE_CONCURRENCY", "4")),
+            max_limit=int(os.getenv("YOUTUBE_MAX_CONCURRENCY", "16")),
+            failure_threshold=int(os.getenv("YOUTUBE_BLOCK_THRESHOLD", "3")),
+            cooldown=float(os.getenv("YOUTUBE_CIRCUIT_COOLDOWN", "30")),
+            max_cooldown=float(os.getenv("YOUTUBE_CIRCUIT_MAX_COOLDOWN", "600")),
+            queue_timeout=float(os.getenv("YOUTUBE_QUEUE_TIMEOUT", "30"))
+        )
+
+        # Preconfigured YoutubeDL instances, reused instead of rebuilt for every call
+        self.ytdl_pool = YoutubeDLPool(
+            max_idle_per_profile=max(1, int(os.getenv("YTDL_POOL_SIZE", "8"))),
+            access=self.youtube_access
+        )
+        self.ytdl_pool.register("track_resolve", TRACK_RESOLVE_OPTS, latency_target=SEARCH_LATENCY_TARGET)
+        self.ytdl_pool.register("track_fetch", TRACK_FETCH_OPTS)
+
+        # Network stages scale with I/O, transcoding with the cores; each stage queue holds
+        # two tasks per worker, so fetched audio never piles up far ahead of ffmpeg
+        stage_workers = {
+            "resolve": int(os.getenv("RESOLVE_WORKERS", "4")),
+            "fetch": int(os.getenv("DOWNLOAD_WORKERS", "4")),
+            "transcode": int(os.getenv("TRANSCODE_WORKERS", str(os.cpu_count() or 1))),
+            "finalize": int(os.getenv("FINALIZE_WORKERS", "2")),
+        }
+        handlers = {
+            "resolve": self._resolve_track,
+            "fetch": self._fetch_track,
+            "transcode": self._transcode_track,
+            "finalize": self._finalize_track,
+        }
+        self.pipeline_workers = {stage: max(1, workers) for stage, workers in stage_workers.items()}
+        self.track_pipeline = TrackPipeline(
+            [
+                (stage, handlers[stage], workers, workers * 2)
+                for stage, workers in self.pipeline_workers.items()
+            ],
+            on_error=self._track_stage_failed
+        )
+
+        self._register_metrics()
+        self._resume_unfinished_jobs()
 
         self.download_path = str(Path.home() / "Downloads" / "Spotify_Downloads")
 
+    def _register_metrics(self):
+        """Gauges and cache counters, read from live state whenever /metrics is scraped"""
+        REGISTRY.callback(
+            "spotify_downloader_active_jobs", "Download jobs queued or running",
+            lambda: len(self.jobs.active())
+        )
+        REGISTRY.callback(
+            "spotify_downloader_admission_queue_depth", "Tracks waiting to enter the track pipeline",
+            self.track_scheduler.queue_depth
+        )
+        REGISTRY.callback(
+            "spotify_downloader_pipeline_queue_depth", "Tracks queued per track pipeline stage",
+            lambda: {(stage,): depth for stage, depth in self.track_pipeline.queue_depths().items()},
+            labelnames=("stage",)
+        )
+        REGISTRY.callback(
+            "spotify_downloader_spotify_executor_queue_depth", "Spotify page requests waiting for a worker",
+            lambda: self.spotify_executor._work_queue.qsize()
+        )
+        caches = {"youtube": self.youtube_cache, "audio": self.audio_cache, "playlist": self.playlist_cache}
+        REGISTRY.callback(
+            "spotify_downloader_cache_hits_total", "Cache lookups that found an entry",
+            lambda: {(name,): cache.hits for name, cache in caches.items()},
+            labelnames=("cache",), kind="counter"
+        )
+        REGISTRY.callback(
+            "spotify_downloader_cache_misses_total", "Cache lookups that found nothing",
+            lambda: {(name,): cache.misses for name, cache in caches.items()},
+            labelnames=("cache",), kind="counter"
+        )
+        REGISTRY.callback(
+            "spotify_downloader_youtube_concurrency_limit", "Concurrent YouTube calls currently permitted (AIMD)",
+            lambda: self.youtube_access.stats()["limit"]
+        )
+        REGISTRY.callback(
+            "spotify_downloader_youtube_in_flight", "YouTube calls in progress",
+            lambda: self.youtube_access.stats()["in_flight"]
+        )
+        REGISTRY.callback(
+            "spotify_downloader_youtube_circuit_open", "1 while the YouTube circuit breaker is open or probing",
+            lambda: 0 if self.youtube_access.stats()["state"] == CIRCUIT_CLOSED else 1
+        )
+        REGISTRY.callback(
+            "spotify_downloader_youtube_circuit_opens_total", "Times the YouTube circuit breaker opened",
+            lambda: self.youtube_access.opened,
+            kind="counter"
+        )
+        REGISTRY.callback(
+            "spotify_downloader_youtube_rejected_total", "YouTube calls refused while blocked or saturated",
+            lambda: self.youtube_access.rejected,
+            kind="counter"
+        )
+        REGISTRY.callback(
+            "spotify_downloader_youtube_failure_skips_total", "YouTube searches skipped while a failure backs off",
+            lambda: self.youtube_cache.failure_hits,
+            kind="counter"
+        )
+
     def _check_credentials(self):
         """Check if credentials exist and are valid"""
         if not os.path.exists(self.env_path):
@@ -150,13 +358,14 @@ class SpotifyDownloaderAPI:
                 redirect_uri=self.redirect_uri,
                 scope="user-library-read playlist-read-private playlist-read-collaborative",
                 cache_path=".spotify_cache",
-                show_dialog=True  # Force showing the auth dialog
+                show_dialog=True,  # Force showing the auth dialog
+                requests_session=self.spotify_session
             )
             
             # Check if there's a cached token
             token_info = self.sp_oauth.get_cached_token()
             if token_info and not self.sp_oauth.is_token_expired(token_info):
-                self.sp = spotipy.Spotify(auth=token_info['access_token'])
+                self.set_spotify_token(token_info['access_token'])
                 logging.info("Using cached Spotify token")
             else:
                 logging.info("No valid cached token found")
@@ -169,6 +378,11 @@ class SpotifyDownloaderAPI:
             self.sp = None
             raise
             
+    def set_spotify_token(self, access_token: str):
+        """Authenticate the shared Spotify client with a new access token"""
+        self.spotify_client.set_auth(access_token)
+        self.sp = self.spotify_client
+
     def is_authenticated(self):
         """Check if user is authenticated with Spotify"""
         is_auth = self.sp is not None
@@ -198,7 +412,10 @@ class SpotifyDownloaderAPI:
             if not playlist_id:
                 return {"error": "Invalid Spotify playlist URL"}
                 
-            playlist = self.sp.playlist(playlist_id)
+            playlist = self.sp.playlist(
+                playlist_id,
+                fields="name,description,owner(display_name),images,tracks(total)"
+            )
             track_count = playlist['tracks']['total']
             
             return {
@@ -232,38 +449,50 @@ class SpotifyDownloaderAPI:
         return cleaned.strip()[:150]
         
     def get_playlist_tracks(self, playlist_id: str) -> List[Dict]:
-        """Fetch all tracks from a playlist"""
-        tracks = []
-        offset = 0
-        limit = 100
-        
-        while True:
-            response = self.sp.playlist_tracks(playlist_id, limit=limit, offset=offset)
-            tracks.extend(response['items'])
-            
-            if len(response['items']) < limit:
-                break
-            offset += limit
+        """Fetch all tracks from a playlist, reusing the cached list while its snapshot is unchanged"""
+        with track_stage("spotify_api"):
+            snapshot_id = self.sp.playlist(playlist_id, fields="snapshot_id")['snapshot_id']
+        cached_tracks = self.playlist_cache.get(playlist_id, snapshot_id)
+        if cached_tracks is not None:
+            logging.info(f"Playlist {playlist_id} unchanged, using cached tracks")
+            return cached_tracks
+
+        tracks = self._fetch_all_pages(
+            lambda offset: self.sp.playlist_tracks(
+                playlist_id, fields=PLAYLIST_TRACK_FIELDS, limit=100, offset=offset
+            ),
+            limit=100
+        )
             
+        self.playlist_cache.put(playlist_id, snapshot_id, tracks)
         return tracks
         
+    def _fetch_all_pages(self, fetch_page, limit: int) -> List[Dict]:
+        """Fetch the first page to learn `total`, then the remaining offsets concurrently"""
+        def timed_fetch_page(offset: int) -> Dict:
+            with track_stage("spotify_api"):
+                return fetch_page(offset)
+
+        first_page = timed_fetch_page(0)
+        items = list(first_page['items'])
+
+        remaining_offsets = range(limit, first_page.get('total') or 0, limit)
+        # map() keeps pages in offset order however they complete
+        for page in self.spotify_executor.map(timed_fetch_page, remaining_offsets):
+            items.extend(page['items'])
+
+        return items
+        
     def get_user_playlists(self):
         """Get current user's playlists"""
         try:
             if not self.sp:
                 return {"error": "Not authenticated with Spotify"}
                 
-            playlists = []
-            offset = 0
-            limit = 50
-            
-            while True:
-                response = self.sp.current_user_playlists(limit=limit, offset=offset)
-                playlists.extend(response['items'])
-                
-                if len(response['items']) < limit:
-                    break
-                offset += limit
+            playlists = self._fetch_all_pages(
+                lambda offset: self.sp.current_user_playlists(limit=50, offset=offset),
+                limit=50
+            )
                 
             # Format playlists for UI display
             formatted_playlists = []
@@ -317,239 +546,469 @@ class SpotifyDownloaderAPI:
 
     def download_selected_tracks(self, playlist_url: str, track_ids: List[str]):
         """Download selected tracks from a playlist"""
-        def download_worker():
-            try:
-                self.is_downloading = True
-                self.download_progress = {"current": 0, "total": len(track_ids), "status": "starting"}
-                
+        job = self.jobs.submit(playlist_url, track_ids)
+        return {"success": True, "message": "Download started", "job_id": job.id}
+
+    def _run_download_job(self, job: DownloadJob):
+        """Body of a job thread: fetch the playlist and download its (selected) tracks"""
+        try:
+            job.update(status="starting")
+
+            record = self.download_queue.get_job(job.id)
+            download_folder = record["download_folder"] if record else self.temp_download_path
+            os.makedirs(download_folder, exist_ok=True)
+
+            checkpoints = self.download_queue.job_tracks(job.id)
+            if checkpoints:
+                # Resuming after a restart: only tracks without a finished file are left
+                entries = [
+                    (c["position"], c["track_info"]) for c in checkpoints
+                    if not (c["state"] == "done" and c["file_path"] and os.path.exists(c["file_path"]))
+                ]
+                finished = len(checkpoints) - len(entries)
+                job.update(total=len(checkpoints), current=finished, successful=finished)
+                self._log_event(f"Resuming job {job.id}: {finished}/{len(checkpoints)} tracks already done", job=job)
+            else:
+                if not self.sp:
+                    job.update(status="error", error="Not authenticated with Spotify")
+                    return
+
                 # Get playlist info
-                playlist_id = self.extract_playlist_id(playlist_url)
+                playlist_id = self.extract_playlist_id(job.playlist_url)
                 if not playlist_id:
-                    self.download_progress["status"] = "error"
-                    self.download_progress["error"] = "Invalid playlist URL"
+                    job.update(status="error", error="Invalid playlist URL")
                     return
                     
-                playlist = self.sp.playlist(playlist_id)
+                playlist = self.sp.playlist(playlist_id, fields="name")
                 playlist_name = self.sanitize_filename(playlist['name'])
+                job.update(playlist_name=playlist_name)
                 
                 # Create download folder
+
                 # download_folder = os.path.join(self.download_path, playlist_name)
                 # os.makedirs(download_folder, exist_ok=True)
-                
-                download_folder = self.temp_download_path
-
 
                 # Get all tracks
-                raw_tracks = self.get_playlist_tracks(playlist_id)
-                
-                # Filter selected tracks
-                selected_tracks = [
-                    t for t in raw_tracks 
-                    if t['track'] and t['track']['id'] in track_ids
-                ]
-                
-                self.download_progress["total"] = len(selected_tracks)
-                self.download_progress["status"] = "downloading"
-                
-                successful_downloads = 0
-                
-                for i, track_info in enumerate(selected_tracks):
-                    if not self.is_downloading:
-                        self.download_progress["status"] = "cancelled"
-                        return
-                        
-                    self.download_progress["current"] = i + 1
-                    self.download_progress["current_track"] = f"{track_info['track']['artists'][0]['name']} - {track_info['track']['name']}"
+                tracks = self.get_playlist_tracks(playlist_id)
+                if job.track_ids is not None:
+                    # Filter selected tracks
+                    selected_ids = set(job.track_ids)
+                    tracks = [
+                        t for t in tracks
+                        if t['track'] and t['track']['id'] in selected_ids
+                    ]
+
+                self.download_queue.add_tracks(job.id, tracks)
+                entries = list(enumerate(tracks))
+                job.update(total=len(tracks))
+            
+            job.update(status="downloading")
+            
+            successful_downloads = self._download_tracks(job, entries, download_folder)
+            if successful_downloads is None:
+                return
                     
-                    if self.download_track(track_info, download_folder):
-                        successful_downloads += 1
-                        
-
-                self.download_progress["status"] = "completed"
-                self.download_progress["successful"] = successful_downloads
-                self.is_downloading = False
-                self.get_downloaded_files()
-                
-            except Exception as e:
-                logging.error(f"Download error: {e}")
-                self.download_progress["status"] = "error"
-                self.download_progress["error"] = str(e)
-                self.is_downloading = False
-                
-        if not self.is_downloading:
-            threading.Thread(target=download_worker, daemon=True).start()
-            return {"success": True, "message": "Download started"}
-        else:
-            return {"error": "Download already in progress"}
+            job.update(status="completed", successful=job.progress.get("successful", 0))
+            
+        except Exception as e:
+            logging.error(f"Download error: {e}")
+            job.update(status="error", error=str(e))
 
-    def download_track(self, track_info: Dict, download_folder: str) -> bool:
-        try:
+    def _download_tracks(self, job: DownloadJob, entries: List[Tuple[int, Dict]], download_folder: str) -> Optional[int]:
+        """
+        Download (position, track_info) entries through the shared track pipeline, checkpointing
+        each track's state. Returns the number of successful downloads, or None if cancelled.
+        """
+        playlist_id = self.extract_playlist_id(job.playlist_url)
+
+        def make_task(position, track_info):
             track = track_info['track']
-            if not track or track['type'] != 'track':
-                return False
-                
-            artist_name = track['artists'][0]['name']
-            track_name = track['name']
-            
-            sanitized_name = self.sanitize_filename(f"{artist_name} - {track_name}")
-            final_file = os.path.join(self.temp_download_path, f"{sanitized_name}.mp3")
 
-            logging.info(f"Starting download: {sanitized_name}")
+            def checkpoint(state: str, file_path: Optional[str] = None):
+                self.download_queue.set_track_state(job.id, position, state, file_path=file_path)
+                if state == "done" and track and track.get('id') and file_path:
+                    self.download_queue.record_download(track['id'], file_path, playlist_id)
 
-            # Search query for YouTube
-            search_query = f"{artist_name} {track_name} official audio"
-            
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': os.path.join(self.temp_download_path, f'{sanitized_name}.%(ext)s'),
-                'noplaylist': True,
-                'quiet': False,  # Keep logs visible for debugging
-                'no_warnings': False,
-                'ignoreerrors': True,
-                'extract_flat': False,
-                'socket_timeout': 30,
-                'retries': 3,
-                'fragment_retries': 3,
-                'skip_unavailable_fragments': True,
-                'keepvideo': False,
-                'writethumbnail': False,
-                'writeinfojson': False,
-                'cookiefile': None,
-                'noprogress': True,
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                },
+            return TrackTask(track_info, download_folder, job, on_state=checkpoint,
+                             staging_name=f"{job.id}-{position}")
+
+        tasks = [make_task(position, track_info) for position, track_info in entries]
+        admissions = [self.track_scheduler.submit(job.id, self.track_pipeline.submit, task) for task in tasks]
+        pending = {task.future for task in tasks}
+        successful_downloads = 0
+
+        try:
+            # Poll so a cancel request is noticed even while long downloads are in flight
+            while pending and not job.cancelled:
+                done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                succeeded = sum(1 for future in done if future.result())
+                successful_downloads += succeeded
+                TRACKS.inc(succeeded, outcome="done")
+                TRACKS.inc(len(done) - succeeded, outcome="failed")
+
+                job.increment("current", len(done))
+                job.increment("successful", succeeded)
+        finally:
+            # Tracks not yet admitted are dropped; admitted ones see the cancellation at their next stage
+            for admission in admissions:
+                admission.cancel()
+
+        if job.cancelled:
+            job.update(status="cancelled")
+            return None
+
+        return successful_downloads
+
+    def sync_playlist(self, playlist_url: str, prune: bool = False):
+        """
+        Bring the downloaded copy of a playlist up to date using the manifest: only tracks
+        without a downloaded file are fetched, and with prune=True files of tracks that
+        left the playlist (and belong to no other synced playlist) are deleted.
+        """
+        try:
+            if not self.sp:
+                return {"error": "Not authenticated with Spotify"}
+
+            playlist_id = self.extract_playlist_id(playlist_url)
+            if not playlist_id:
+                return {"error": "Invalid Spotify playlist URL"}
+
+            current_ids = list(dict.fromkeys(
+                item['track']['id'] for item in self.get_playlist_tracks(playlist_id)
+                if item['track'] and item['track'].get('id') and item['track']['type'] == 'track'
+            ))
+
+            manifest = self.download_queue.manifest_files(current_ids)
+            present = [track_id for track_id in current_ids
+                       if track_id in manifest and os.path.exists(manifest[track_id])]
+            present_ids = set(present)
+            added = [track_id for track_id in current_ids if track_id not in present_ids]
+            # Tracks downloaded for another playlist count as present for this one too
+            self.download_queue.set_playlist_members(playlist_id, present)
+
+            current = set(current_ids)
+            removed = [track_id for track_id in self.download_queue.playlist_members(playlist_id)
+                       if track_id not in current]
+
+            pruned_files = 0
+            if prune and removed:
+                for file_path in self.download_queue.remove_from_playlist(playlist_id, removed):
+                    try:
+                        os.unlink(file_path)
+                        pruned_files += 1
+                    except FileNotFoundError:
+                        pass
+
+            result = {
+                "success": True,
+                "added": len(added),
+                "removed": len(removed),
+                "pruned_files": pruned_files,
+                "unchanged": len(present),
             }
-            
-            try:
-                with YoutubeDL(ydl_opts) as ydl:
-                    # Search and download with timeout
-                    ydl.download([f"ytsearch1:{search_query}"])
-                    
-                # Check if file was created successfully
-                if os.path.exists(final_file):
-                    logging.info(f"✅ Successfully downloaded: {sanitized_name}")
-                    return True
-                else:
-                    # Check for any .mp3 file with similar name
-                    for file in os.listdir(self.temp_download_path):
-                        if file.startswith(sanitized_name) and file.endswith('.mp3'):
-                            logging.info(f"✅ Found downloaded file: {file}")
-                            return True
-                    
-                    logging.warning(f"❌ No output file created for: {sanitized_name}")
-                    return False
-                    
-            except Exception as e:
-                logging.error(f"Download failed for {sanitized_name}: {str(e)}")
-                return False
-                
+            if added:
+                result["job_id"] = self.jobs.submit(playlist_url, added).id
+
+            logging.info(f"Synced playlist {playlist_id}: {result}")
+            return result
+
         except Exception as e:
-            logging.error(f"Error in download_track for {track_name}: {str(e)}")
+            logging.error(f"Error syncing playlist: {e}")
+            return {"error": str(e)}
+
+    def _persist_job_status(self, job: DownloadJob):
+        """Mirror job status changes into the durable queue"""
+        try:
+            self.download_queue.add_job(
+                job.id, job.playlist_url, job.track_ids, self.temp_download_path,
+                job.progress["status"], job.created_at
+            )
+        except Exception as e:
+            logging.error(f"Failed to persist status of job {job.id}: {e}")
+
+    def _resume_unfinished_jobs(self):
+        """Re-queue jobs that were still running when the process stopped"""
+        for record in self.download_queue.unfinished_jobs():
+            logging.info(f"Resuming download job {record['id']} for {record['playlist_url']}")
+            self.jobs.submit(
+                record["playlist_url"], record["track_ids"],
+                job_id=record["id"], created_at=record["created_at"]
+            )
+
+    def download_track(self, track_info: Dict, download_folder: str, job: Optional[DownloadJob] = None,
+                       on_state: Optional[Callable[..., None]] = None) -> bool:
+        """
+        Download one track in the configured audio format into download_folder through the track pipeline and wait
+        for it. on_state, when given, is called as on_state(state, file_path=None) on each
+        checkpoint: resolving, downloading, transcoding, then done or failed.
+        """
+        return self.track_pipeline.submit(TrackTask(track_info, download_folder, job, on_state)).result()
+
+    def _resolve_track(self, task: TrackTask) -> Optional[bool]:
+        """Pipeline stage: find the track's video, finishing early when its audio already exists"""
+        job = task.job
+        # Tracks still queued when the job is cancelled are skipped
+        if job and job.cancelled:
             return False
 
-    def _create_progress_hook(self):
-        def progress_hook(d):
-            status = d.get('status')
-            if status == 'downloading':
-                downloaded = d.get('downloaded_bytes', 0)
-                total     = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                percent   = downloaded / total * 100 if total else 0
-                msg = f"Downloading {d.get('filename')} — {percent:.1f}%"
-                self.download_progress.update({
-                    "current": d.get('downloaded_bytes', 0),
-                    "total": total,
-                    "status": "downloading",
-                    "percent": percent
-                })
-                self.download_log.append(msg)
+        track = task.track_info['track']
+        if not track or track['type'] != 'track':
+            task.checkpoint("failed")
+            return False
 
-                # enforce your timeout if you want
-                if d.get('elapsed') and d['elapsed'] > 120:
-                    raise Exception("Download timed out")
+        artist_name = track['artists'][0]['name']
+        track_name = track['name']
+        if job:
+            job.update(current_track=f"{artist_name} - {track_name}")
 
-            elif status in ('finished', 'error'):
-                msg = f"{'Finished' if status=='finished' else 'Error'}: {d.get('filename')}"
-                self.download_progress["status"] = status
-                self.download_log.append(msg)
+        task.sanitized_name = self.sanitize_filename(f"{artist_name} - {track_name}")
+        task.final_file = os.path.join(task.download_folder, f"{task.sanitized_name}.{AUDIO_CODEC}")
+
+        # O(1) completion check against files this server has already produced
+        existing_file = self._downloaded_file(track.get('id'))
+        if existing_file and os.path.dirname(existing_file) == os.path.normpath(task.download_folder):
+            self._log_event(f"✅ Already downloaded: {task.sanitized_name}", job=job)
+            task.checkpoint("done", existing_file)
+            return True
+
+        self._log_event(f"Starting download: {task.sanitized_name}", job=job)
+        task.checkpoint("resolving")
+
+        # Reuse a previous match when we have one, otherwise search YouTube
+        video = self.youtube_cache.get(track.get('id'), artist_name, track_name)
+        task.from_cache = video is not None
+        if not video:
+            # Tracks that failed recently are not searched again until their backoff expires
+            failure = self.youtube_cache.get_failure(track.get('id'), artist_name, track_name)
+            if failure:
+                self._log_event(
+                    f"⏭️ Skipping {task.sanitized_name}: {failure['reason']} "
+                    f"(failed {failure['failures']}x, retry in {int(failure['retry_at'] - time.time())}s)",
+                    logging.WARNING, job=job
+                )
+                task.checkpoint("failed")
+                return False
 
-        return progress_hook
-            
-    def start_download(self, playlist_url: str):
-        """Start downloading playlist in background thread"""
-        def download_worker():
             try:
-                self.is_downloading = True
-                self.download_progress = {"current": 0, "total": 0, "status": "starting"}
-                
-                # Get playlist info
-                playlist_id = self.extract_playlist_id(playlist_url)
-                if not playlist_id:
-                    self.download_progress["status"] = "error"
-                    self.download_progress["error"] = "Invalid playlist URL"
-                    return
-                    
-                playlist = self.sp.playlist(playlist_id)
-                playlist_name = self.sanitize_filename(playlist['name'])
-                
-                # Create download folder
+                with track_stage("youtube_search") as stage, self.ytdl_pool.acquire("track_resolve", wait=True) as ydl:
+                    # Top candidates ranked against the Spotify length, so loops and live cuts are never fetched
+                    video = TrackMatcher(track_name, artist_name, track.get('duration_ms')).best(
+                        ydl.extract_info(search_url(f"{artist_name} {track_name} official audio"), download=False)
+                    )
+                    if not video:
+                        stage.fail()
+            except Exception as e:
+                self.youtube_cache.record_failure(failure_reason(e), track.get('id'), artist_name, track_name)
+                raise
+            if not video:
+                self.youtube_cache.record_failure(failure_reason(), track.get('id'), artist_name, track_name)
+                self._log_event(f"❌ No YouTube match for: {task.sanitized_name}", logging.WARNING, job=job)
+                task.checkpoint("failed")
+                return False
+        task.video = video
 
-                # download_folder = os.path.join(self.download_path, playlist_name)
-                # os.makedirs(download_folder, exist_ok=True)
-                
-                download_folder = self.temp_download_path
+        # Already transcoded for another request: no download or ffmpeg work at all
+        if self.audio_cache.copy_to(video['id'], AUDIO_CODEC, AUDIO_QUALITY, task.final_file):
+            self._log_event(f"✅ Served from audio cache: {task.sanitized_name}", job=job)
+            self._record_produced_file(track.get('id'), task.final_file)
+            if not task.from_cache:
+                self.youtube_cache.put(video, track.get('id'), artist_name, track_name)
+            task.checkpoint("done", task.final_file)
+            return True
+        return None
 
-                # Get all tracks
-                tracks = self.get_playlist_tracks(playlist_id)
-                total_tracks = len(tracks)
-                
-                self.download_progress["total"] = total_tracks
-                self.download_progress["status"] = "downloading"
-                
-                successful_downloads = 0
-                
-                for i, track_info in enumerate(tracks):
-                    if not self.is_downloading:
-                        self.download_progress["status"] = "cancelled"
-                        return
-                        
-                    track = track_info['track']
-                    self.download_progress["current"] = i + 1
-                    self.download_progress["current_track"] = f"{track['artists'][0]['name']} - {track['name']}"
-                    
-                    if self.download_track(track_info, download_folder):
-                        successful_downloads += 1
-                        
-                self.download_progress["status"] = "completed"
-                self.download_progress["successful"] = successful_downloads
-                self.is_downloading = False
-                
+    def _fetch_track(self, task: TrackTask) -> Optional[bool]:
+        """Pipeline stage: download the source audio without any post-processing"""
+        if task.job and task.job.cancelled:
+            return False
+
+        task.checkpoint("downloading")
+        staging_folder = os.path.join(task.download_folder, STAGING_DIR_NAME)
+        os.makedirs(staging_folder, exist_ok=True)
+
+        # yt-dlp reports the final path once the download is complete
+        produced_files = []
+        info = None
+        with track_stage("download") as stage:
+            try:
+                with self.ytdl_pool.acquire(
+                    "track_fetch",
+                    wait=True,
+                    outtmpl=os.path.join(staging_folder, f"{task.staging_name or uuid.uuid4().hex}.%(ext)s"),
+                    post_hooks=[produced_files.append],
+                ) as ydl:
+                    info = ydl.extract_info(f"https://www.youtube.com/watch?v={task.video['id']}", download=True)
             except Exception as e:
-                logging.error(f"Download error: {e}")
-                self.download_progress["status"] = "error"
-                self.download_progress["error"] = str(e)
-                self.is_downloading = False
-                
-        if not self.is_downloading:
-            threading.Thread(target=download_worker, daemon=True).start()
-            return {"success": True, "message": "Download started"}
-        else:
-            return {"error": "Download already in progress"}
+                # Already counted by the access controller; handled below like a missing file
+                self._log_event(f"Download error for {task.sanitized_name}: {e}", logging.WARNING, job=task.job)
+
+            raw_file = produced_files[-1] if produced_files else None
+            if not raw_file or not os.path.exists(raw_file):
+                stage.fail()
+
+        if not raw_file or not os.path.exists(raw_file):
+            if task.from_cache:
+                # The cached video no longer works; search again next time
+                track = task.track_info['track']
+                self.youtube_cache.invalidate(track.get('id'), track['artists'][0]['name'], track['name'])
+            self._log_event(f"❌ No output file created for: {task.sanitized_name}", logging.WARNING, job=task.job)
+            task.checkpoint("failed")
+            return False
+
+        task.raw_file = raw_file
+        task.source_acodec = (info or {}).get('acodec')
+        return None
+
+    def _transcode_track(self, task: TrackTask) -> Optional[bool]:
+        """
+        Pipeline stage: encode the fetched audio with ffmpeg, or just remux it when the source
+        already has the output codec. Encoding is CPU bound, so the stage is sized to the cores.
+        """
+        raw_file, task.raw_file = task.raw_file, None
+        try:
+            if task.job and task.job.cancelled:
+                return False
+
+            task.checkpoint("transcoding")
+            # Encode next to the raw file and rename, so the download folder never holds a partial file
+            encoded_file = f"{raw_file}.{AUDIO_CODEC}"
+            with track_stage("transcode") as stage:
+                result = subprocess.run(
+                    ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-i', raw_file, '-vn',
+                     *ffmpeg_codec_args(AUDIO_CODEC, AUDIO_QUALITY, task.source_acodec), encoded_file],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE
+                )
+                if result.returncode != 0:
+                    stage.fail()
+            if result.returncode != 0 or not os.path.exists(encoded_file):
+                if os.path.exists(encoded_file):
+                    os.unlink(encoded_file)
+                error = result.stderr.decode(errors='replace').strip()
+                self._log_event(f"❌ Transcode failed for {task.sanitized_name}: {error}", logging.WARNING, job=task.job)
+                task.checkpoint("failed")
+                return False
+
+            os.replace(encoded_file, task.final_file)
+            return None
+        finally:
+            if os.path.exists(raw_file):
+                os.unlink(raw_file)
+
+    def _finalize_track(self, task: TrackTask) -> bool:
+        """Pipeline stage: record the finished file and add it to the caches"""
+        track = task.track_info['track']
+        self._log_event(f"✅ Successfully downloaded: {task.sanitized_name}", job=task.job)
+        self._record_produced_file(track.get('id'), task.final_file)
+        self.audio_cache.put(task.video['id'], AUDIO_CODEC, AUDIO_QUALITY, task.final_file)
+        if not task.from_cache:
+            self.youtube_cache.put(task.video, track.get('id'), track['artists'][0]['name'], track['name'])
+        task.checkpoint("done", task.final_file)
+        return True
+
+    def _track_stage_failed(self, task: TrackTask, stage: str, error: BaseException):
+        name = task.sanitized_name or "unknown track"
+        self._log_event(f"Download failed for {name} ({stage}): {error}", logging.ERROR, job=task.job)
+        if task.raw_file and os.path.exists(task.raw_file):
+            os.unlink(task.raw_file)
+        task.checkpoint("failed")
+
+    def _record_produced_file(self, track_id: Optional[str], file_path: str):
+        if track_id:
+            with self._file_index_lock:
+                self._file_index[track_id] = file_path
+
+    def _downloaded_file(self, track_id: Optional[str]) -> Optional[str]:
+        """Path of a track's finished file, from the in-memory index or the persistent manifest"""
+        if not track_id:
+            return None
+
+        with self._file_index_lock:
+            file_path = self._file_index.get(track_id)
+        if not file_path:
+            file_path = self.download_queue.manifest_files([track_id]).get(track_id)
+        if file_path and os.path.exists(file_path):
+            return file_path
+        return None
+
+    def _log_event(self, message: str, level: int = logging.INFO, job: Optional[DownloadJob] = None):
+        """Log a download event and push it to the global and per-job log streams"""
+        logging.log(level, message)
+        self.log_bus.publish(message)
+        if job:
+            job.log.publish(message)
+
+    def start_download(self, playlist_url: str):
+        """Start downloading playlist as a background job"""
+        job = self.jobs.submit(playlist_url)
+        return {"success": True, "message": "Download started", "job_id": job.id}
             
     def stop_download(self):
-        """Stop current download"""
-        self.is_downloading = False
+        """Stop every running download"""
+        for job in self.jobs.active():
+            job.cancel()
         return {"success": True, "message": "Download stopped"}
+
+    @property
+    def is_downloading(self) -> bool:
+        return bool(self.jobs.active())
+
+    @property
+    def download_progress(self) -> Dict:
+        """Progress of the most recent job, for clients that predate the job endpoints"""
+        job = self.jobs.latest()
+        if not job:
+            return {"current": 0, "total": 0, "status": "idle"}
+        return dict(job.to_dict()["progress"], job_id=job.id)
         
     def get_download_progress(self):
         """Get current download progress"""
         return self.download_progress
+
+    def list_jobs(self):
+        return {"jobs": [job.to_dict() for job in self.jobs.list()]}
+
+    def get_job(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if not job:
+            return {"error": "Job not found"}
+        return job.to_dict()
+
+    def get_job_files(self, job_id: str):
+        """Finished files of a job in playlist order, for bulk export"""
+        job = self.jobs.get(job_id)
+        record = self.download_queue.get_job(job_id)
+        if not job and not record:
+            return {"error": "Job not found"}
+        if job and job.is_active:
+            return {"error": "Job is still running"}
+
+        files = []
+        seen = set()
+        for checkpoint in self.download_queue.job_tracks(job_id):
+            file_path = checkpoint["file_path"]
+            if checkpoint["state"] == "done" and file_path and file_path not in seen and os.path.exists(file_path):
+                seen.add(file_path)
+                files.append(file_path)
+
+        name = (job.progress.get("playlist_name") if job else None) or f"spotify-{job_id}"
+        return {"name": name, "files": files}
+
+    def cancel_job(self, job_id: str):
+        if not self.jobs.cancel(job_id):
+            return {"error": "Job not found"}
+        return {"success": True, "message": "Job cancelled"}
     
+    def get_downloaded_file_path(self, filename: str) -> Optional[str]:
+        """Resolve a name from get_downloaded_files to its path, refusing anything outside the folder"""
+        if not filename or os.path.basename(filename) != filename or filename.startswith('.'):
+            return None
+        if filename.endswith('.part'):
+            return None
+
+        path = os.path.join(self.temp_download_path, filename)
+        return path if os.path.isfile(path) else None
+
     def get_downloaded_files(self):
         try:
             if not os.path.exists(self.temp_download_path):
@@ -566,7 +1025,7 @@ class SpotifyDownloaderAPI:
             logging.error(f"Error listing downloaded files: {e}")
             return {"error": str(e)}
         
-def cleanup_temp_files(self):
+    def cleanup_temp_files(self):
         try:
             import shutil
             if os.path.exists(self.temp_download_path):
@@ -575,5 +1034,5 @@ def cleanup_temp_files(self):
         except Exception as e:
             logging.error(f"Error cleaning temp files: {e}")
 
-        def get_download_logs(self):
-                return {"logs": self.download_log}
+    def get_download_logs(self):
+        return {"logs": self.log_bus.snapshot()}
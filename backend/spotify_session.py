@@ -0,0 +1,108 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import SPOTIFY_RETRIES, SPOTIFY_THROTTLE_SECONDS, SPOTIFY_THROTTLED
+
+RETRYABLE_STATUS = (500, 502, 503, 504)
+# Safe to resend after a server error or a dropped connection
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+def _retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Retry-After as seconds; Spotify sends an integer, HTTP also allows a date"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SpotifySession(requests.Session):
+    """
+    Keep-alive session shared by every Spotify API and token request.
+
+    A 429 holds back all requests on the session for the Retry-After period, not only
+    the one that was throttled, since concurrent page fetches share the same rate limit.
+    429s, 5xx responses and dropped connections are retried with jittered exponential
+    backoff, so one throttled page does not abort a whole playlist fetch.
+    """
+
+    def __init__(self, pool_size: int = 16, max_retries: int = 5, backoff: float = 0.5,
+                 max_backoff: float = 30.0, max_retry_after: float = 120.0):
+        super().__init__()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self._throttled_until = 0.0
+        self._throttle_lock = threading.Lock()
+
+        # Retries are handled in request(); the adapter only pools connections
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Full jitter: uniform over [0, backoff * 2^attempt], capped"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _hold_back(self, delay: float):
+        with self._throttle_lock:
+            self._throttled_until = max(self._throttled_until, time.monotonic() + delay)
+
+    def _wait_for_throttle(self):
+        with self._throttle_lock:
+            remaining = self._throttled_until - time.monotonic()
+        if remaining > 0:
+            SPOTIFY_THROTTLE_SECONDS.inc(remaining)
+            time.sleep(remaining)
+
+    def request(self, method, url, *args, **kwargs):
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            self._wait_for_throttle()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt or not idempotent:
+                    raise
+                SPOTIFY_RETRIES.inc(reason="connection")
+                logging.warning(f"Spotify request failed ({e}), retrying")
+                time.sleep(self._backoff_delay(attempt))
+                continue
+
+            if response.status_code == 429:
+                SPOTIFY_THROTTLED.inc()
+                retry_after = _retry_after_seconds(response)
+                # Too long to wait inside a request: let the caller see the 429
+                if last_attempt or (retry_after is not None and retry_after > self.max_retry_after):
+                    return response
+                # Jitter on top of Retry-After, so waiting threads do not all resume at once
+                delay = (retry_after if retry_after is not None else 0.0) + self._backoff_delay(attempt)
+                logging.warning(f"Spotify rate limit hit, retrying in {delay:.1f}s")
+                SPOTIFY_RETRIES.inc(reason="throttled")
+                response.close()
+                self._hold_back(delay)
+                continue
+
+            if response.status_code in RETRYABLE_STATUS and idempotent and not last_attempt:
+                SPOTIFY_RETRIES.inc(reason="server_error")
+                response.close()
+                time.sleep(self._backoff_delay(attempt))
+                continue
+
+            return response
@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class TrackTask:
+    """One track moving through the download pipeline; stages hand data on through its attributes"""
+
+    def __init__(self, track_info: Dict, download_folder: str, job=None,
+                 on_state: Optional[Callable[..., None]] = None, staging_name: Optional[str] = None):
+        self.track_info = track_info
+        self.download_folder = download_folder
+        self.job = job
+        # Stable name for the raw download, so a resumed job reuses or overwrites its own file
+        self.staging_name = staging_name
+        self.future: Future = Future()
+
+        # Filled in as the task advances
+        self.sanitized_name: Optional[str] = None
+        self.final_file: Optional[str] = None
+        self.video: Optional[Dict] = None
+        self.from_cache = False
+        self.raw_file: Optional[str] = None
+        self.source_acodec: Optional[str] = None
+
+        self._on_state = on_state
+        self._reached_states: List[str] = []
+
+    def checkpoint(self, state: str, file_path: Optional[str] = None):
+        if self._on_state and (not self._reached_states or self._reached_states[-1] != state):
+            self._reached_states.append(state)
+            self._on_state(state, file_path)
+
+    def finish(self, success: bool):
+        if not self.future.done():
+            self.future.set_result(success)
+
+
+class TrackPipeline:
+    """
+    Fixed sequence of stages, each with its own bounded queue and worker threads.
+    A handler returns True/False to finish the task with that result, or None to pass
+    it to the next stage. A full queue blocks the stage feeding it, so a slow stage
+    throttles the ones before it instead of letting work pile up.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[TrackTask], Optional[bool]], int, int]],
+                 on_error: Optional[Callable[[TrackTask, str, BaseException], None]] = None):
+        # (name, handler, workers, queue_size) in processing order
+        self._on_error = on_error
+        self._names = [name for name, _, _, _ in stages]
+        self._handlers = [handler for _, handler, _, _ in stages]
+        self._queues: List["queue.Queue[TrackTask]"] = [
+            queue.Queue(maxsize=queue_size) for _, _, _, queue_size in stages
+        ]
+
+        for index, (name, _, workers, _) in enumerate(stages):
+            for i in range(workers):
+                threading.Thread(
+                    target=self._worker, args=(index,), name=f"pipeline-{name}-{i}", daemon=True
+                ).start()
+
+    def submit(self, task: TrackTask) -> Future:
+        """Enter the first stage, blocking while its queue is full"""
+        self._queues[0].put(task)
+        return task.future
+
+    def _worker(self, index: int):
+        handler = self._handlers[index]
+        is_last = index == len(self._handlers) - 1
+        while True:
+            task = self._queues[index].get()
+            try:
+                result = handler(task)
+            except BaseException as e:
+                try:
+                    if self._on_error:
+                        self._on_error(task, self._names[index], e)
+                    else:
+                        logging.error(f"Pipeline stage {self._names[index]} failed: {e}")
+                except Exception as handler_error:
+                    logging.error(f"Pipeline error handler failed: {handler_error}")
+                task.finish(False)
+                continue
+
+            if result is not None or is_last:
+                task.finish(bool(result))
+            else:
+                self._queues[index + 1].put(task)
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {name: q.qsize() for name, q in zip(self._names, self._queues)}
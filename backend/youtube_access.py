@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from youtube_cache import REASON_BOT_BLOCKED, REASON_TIMEOUT, failure_reason
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+# Metadata calls (searches, stream resolution) slower than this count as congestion. Kept
+# below the shortest caller timeout (8s, batch links): a search the client already gave up
+# on must not count as a success when its executor thread finally returns.
+SEARCH_LATENCY_TARGET = float(os.getenv("YOUTUBE_LATENCY_TARGET", "6"))
+# Failures arriving together are one congestion event: halve at most once per interval
+DECREASE_INTERVAL = 2.0
+
+
+class YouTubeUnavailable(Exception):
+    """A call that was not made because YouTube is blocking us or every slot stayed busy"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class YouTubeAccessController:
+    """
+    Shared gate in front of every yt-dlp call.
+
+    Permitted concurrency follows AIMD: a call that completes within its latency target
+    raises the limit by 1/limit (about +1 per round of calls), while a timeout, a bot
+    block or a slow call halves it. Consecutive blocks open the circuit: calls fail fast
+    (or wait, for background work) until the cooldown passes, then a single probe call
+    either closes the circuit or reopens it with a doubled cooldown.
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 16,
+                 failure_threshold: int = 3, cooldown: float = 30.0, max_cooldown: float = 600.0,
+                 queue_timeout: float = 30.0):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.queue_timeout = queue_timeout
+
+        self.state = CIRCUIT_CLOSED
+        self.in_flight = 0
+        self.waiting = 0
+        self.consecutive_blocks = 0
+        self.cooldown = cooldown
+        self.retry_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+        self.decreases = 0
+        self._probe_in_flight = False
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, wait: bool = False, latency_target: Optional[float] = None):
+        """
+        Hold one permitted call for the duration of the block. Interactive callers get
+        YouTubeUnavailable while the circuit is open or after queue_timeout without a
+        free slot; wait=True (background jobs) sleeps until the call can be made.
+        """
+        probe = self._enter(wait)
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self._exit(probe, time.perf_counter() - start, latency_target, e)
+            raise
+        self._exit(probe, time.perf_counter() - start, latency_target, None)
+
+    def is_open(self) -> bool:
+        with self._cond:
+            return self.state == CIRCUIT_OPEN and time.monotonic() < self.retry_at
+
+    def retry_after(self) -> float:
+        with self._cond:
+            return max(0.0, self.retry_at - time.monotonic())
+
+    def _enter(self, wait: bool) -> bool:
+        """Take a slot; True when this call is the half-open probe"""
+        deadline = None if wait else time.monotonic() + self.queue_timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self.state == CIRCUIT_OPEN and now >= self.retry_at:
+                        self.state = CIRCUIT_HALF_OPEN
+                        logging.info("YouTube circuit half-open: sending a probe request")
+
+                    if self.state == CIRCUIT_HALF_OPEN and not self._probe_in_flight:
+                        self._probe_in_flight = True
+                        self.in_flight += 1
+                        return True
+                    if self.state == CIRCUIT_CLOSED and self.in_flight < int(self.limit):
+                        self.in_flight += 1
+                        return False
+
+                    blocked = self.state != CIRCUIT_CLOSED
+                    if blocked and not wait:
+                        self.rejected += 1
+                        raise YouTubeUnavailable(
+                            "YouTube is blocking requests; retrying later",
+                            retry_after=max(1.0, self.retry_at - now)
+                        )
+                    if deadline is not None and now >= deadline:
+                        self.rejected += 1
+                        raise YouTubeUnavailable("All YouTube request slots are busy", retry_after=1.0)
+
+                    timeout = self.retry_at - now if self.state == CIRCUIT_OPEN else None
+                    if deadline is not None:
+                        timeout = min(timeout, deadline - now) if timeout is not None else deadline - now
+                    self._cond.wait(timeout)
+            finally:
+                self.waiting -= 1
+
+    def _exit(self, probe: bool, elapsed: float, latency_target: Optional[float],
+              error: Optional[BaseException]):
+        reason = failure_reason(error) if error is not None else None
+        slow = latency_target is not None and elapsed > latency_target
+
+        with self._cond:
+            self.in_flight -= 1
+            if probe:
+                self._probe_in_flight = False
+
+            if reason == REASON_BOT_BLOCKED:
+                self.consecutive_blocks += 1
+                self._decrease()
+                if probe or self.consecutive_blocks >= self.failure_threshold:
+                    self._open(reopen=probe, cause=f"{self.consecutive_blocks} blocked requests in a row")
+            elif reason == REASON_TIMEOUT or slow:
+                self._decrease()
+                if probe:
+                    self._open(reopen=True, cause="probe request timed out")
+            else:
+                # Success, or an error about the video itself (unavailable, no results)
+                self.consecutive_blocks = 0
+                if probe:
+                    self._close()
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(self.min_limit, self.limit / 2)
+
+    def _open(self, reopen: bool, cause: str):
+        self.cooldown = min(self.max_cooldown, self.cooldown * 2) if reopen else self.base_cooldown
+        self.state = CIRCUIT_OPEN
+        self.retry_at = time.monotonic() + self.cooldown
+        self.opened += 1
+        logging.warning(f"YouTube circuit open for {self.cooldown:.0f}s: {cause}")
+
+    def _close(self):
+        self.state = CIRCUIT_CLOSED
+        self.cooldown = self.base_cooldown
+        self.consecutive_blocks = 0
+        logging.info("YouTube circuit closed: probe request succeeded")
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "state": self.state,
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "consecutive_blocks": self.consecutive_blocks,
+                "retry_after": max(0.0, self.retry_at - time.monotonic()) if self.state == CIRCUIT_OPEN else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "decreases": self.decreases,
+            }
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Why a lookup failed; each backs off from its own base delay, doubling per repeat failure
+REASON_NOT_FOUND = "not-found"
+REASON_TIMEOUT = "timeout"
+REASON_BOT_BLOCKED = "bot-blocked"
+REASON_ERROR = "error"
+FAILURE_BACKOFF_SECONDS = {
+    # Search results rarely change within hours
+    REASON_NOT_FOUND: 6 * 3600,
+    # Transient: YouTube was slow or the network hiccupped
+    REASON_TIMEOUT: 5 * 60,
+    REASON_BOT_BLOCKED: 15 * 60,
+    REASON_ERROR: 10 * 60,
+}
+BOT_BLOCK_MARKERS = ("not a bot", "sign in to confirm", "http error 429", "too many requests")
+
+
+def failure_reason(error: Optional[BaseException] = None) -> str:
+    """Reason code for a failed lookup; no error means the search simply found nothing"""
+    if error is None:
+        return REASON_NOT_FOUND
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return REASON_TIMEOUT
+    message = str(error).lower()
+    if any(marker in message for marker in BOT_BLOCK_MARKERS):
+        return REASON_BOT_BLOCKED
+    if "timed out" in message:
+        return REASON_TIMEOUT
+    return REASON_ERROR
+
+
+class YouTubeCache:
+    """
+    Durable Spotify track -> YouTube video map, so repeat runs skip the search.
+    Failed lookups are remembered too, and skipped until their backoff expires.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: int = 30 * 24 * 3600, max_backoff_seconds: int = 7 * 24 * 3600):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.hits = 0
+        self.misses = 0
+        self.failure_hits = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS youtube_matches (
+                cache_key TEXT PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                title TEXT,
+                duration REAL,
+                resolved_at REAL NOT NULL,
+                confidence REAL
+            )"""
+        )
+        # Databases created before match scoring lack the confidence column
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(youtube_matches)")}
+        if "confidence" not in columns:
+            self._conn.execute("ALTER TABLE youtube_matches ADD COLUMN confidence REAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS youtube_failures (
+                cache_key TEXT PRIMARY KEY,
+                reason TEXT NOT NULL,
+                failures INTEGER NOT NULL,
+                failed_at REAL NOT NULL,
+                retry_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+        logging.info(f"YouTube resolution cache: {db_path}")
+
+    @staticmethod
+    def _normalize(value: str) -> str:
+        return re.sub(r'\s+', ' ', value.strip().lower())
+
+    def _keys(self, track_id: Optional[str], artist: Optional[str], track_name: Optional[str]) -> List[str]:
+        """Spotify id first, artist+title as the fallback key"""
+        keys = []
+        if track_id:
+            keys.append(f"id:{track_id}")
+        if artist and track_name:
+            keys.append(f"name:{self._normalize(artist)}|{self._normalize(track_name)}")
+        return keys
+
+    def get(self, track_id: Optional[str] = None, artist: Optional[str] = None,
+            track_name: Optional[str] = None) -> Optional[Dict]:
+        """Return the cached video for a track, or None if missing or expired"""
+        keys = self._keys(track_id, artist, track_name)
+        cutoff = time.time() - self.ttl_seconds
+
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT video_id, title, duration, resolved_at, confidence FROM youtube_matches "
+                    "WHERE cache_key = ?",
+                    (key,)
+                ).fetchone()
+                if row and row[3] >= cutoff:
+                    self.hits += 1
+                    return {"id": row[0], "title": row[1], "duration": row[2], "confidence": row[4]}
+
+            self.misses += 1
+            return None
+
+    def put(self, video: Dict, track_id: Optional[str] = None, artist: Optional[str] = None,
+            track_name: Optional[str] = None):
+        """Remember the video chosen for a track under all of its keys"""
+        keys = self._keys(track_id, artist, track_name)
+        if not keys or not video or not video.get('id'):
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO youtube_matches "
+                "(cache_key, video_id, title, duration, resolved_at, confidence) VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, video['id'], video.get('title'), video.get('duration'), now, video.get('confidence'))
+                 for key in keys]
+            )
+            # Found at last: earlier failures no longer apply
+            self._conn.execute(
+                f"DELETE FROM youtube_failures WHERE cache_key IN ({','.join('?' * len(keys))})",
+                keys
+            )
+            self._conn.commit()
+
+    def get_failure(self, track_id: Optional[str] = None, artist: Optional[str] = None,
+                    track_name: Optional[str] = None) -> Optional[Dict]:
+        """The recorded failure for a track while it is still backing off, else None"""
+        keys = self._keys(track_id, artist, track_name)
+        if not keys:
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT reason, failures, retry_at FROM youtube_failures "
+                f"WHERE cache_key IN ({','.join('?' * len(keys))}) AND retry_at > ? "
+                f"ORDER BY retry_at DESC LIMIT 1",
+                (*keys, now)
+            ).fetchone()
+            if not row:
+                return None
+            self.failure_hits += 1
+            return {"reason": row[0], "failures": row[1], "retry_at": row[2]}
+
+    def record_failure(self, reason: str, track_id: Optional[str] = None, artist: Optional[str] = None,
+                       track_name: Optional[str] = None) -> Optional[Dict]:
+        """
+        Remember a failed lookup. The track is skipped for the reason's base delay, doubled
+        for every consecutive failure up to max_backoff_seconds, with jitter so a batch of
+        failures does not come due all at once.
+        """
+        keys = self._keys(track_id, artist, track_name)
+        if not keys:
+            return None
+
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute(
+                f"SELECT MAX(failures) FROM youtube_failures WHERE cache_key IN ({','.join('?' * len(keys))})",
+                keys
+            ).fetchone()[0] or 0
+            failures = previous + 1
+            base = FAILURE_BACKOFF_SECONDS.get(reason, FAILURE_BACKOFF_SECONDS[REASON_ERROR])
+            backoff = min(self.max_backoff_seconds, base * 2 ** (failures - 1)) * random.uniform(0.9, 1.1)
+            retry_at = now + backoff
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO youtube_failures (cache_key, reason, failures, failed_at, retry_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, reason, failures, now, retry_at) for key in keys]
+            )
+            self._conn.commit()
+        return {"reason": reason, "failures": failures, "retry_at": retry_at}
+
+    def invalidate(self, track_id: Optional[str] = None, artist: Optional[str] = None,
+                   track_name: Optional[str] = None, everything: bool = False) -> int:
+        """Drop cached matches and failures for a track; everything=True flushes both tables"""
+        keys = self._keys(track_id, artist, track_name)
+        if not keys and not everything:
+            return 0
+
+        removed = 0
+        with self._lock:
+            for table in ("youtube_matches", "youtube_failures"):
+                if keys:
+                    cursor = self._conn.execute(
+                        f"DELETE FROM {table} WHERE cache_key IN ({','.join('?' * len(keys))})",
+                        keys
+                    )
+                else:
+                    cursor = self._conn.execute(f"DELETE FROM {table}")
+                removed += cursor.rowcount
+            self._conn.commit()
+            return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM youtube_matches").fetchone()[0]
+            backing_off = dict(self._conn.execute(
+                "SELECT reason, COUNT(*) FROM youtube_failures WHERE retry_at > ? GROUP BY reason",
+                (time.time(),)
+            ).fetchall())
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "ttl_seconds": self.ttl_seconds,
+                # Keys, not tracks: a track with an id is stored under two
+                "failures_backing_off": backing_off,
+                "failure_hits": self.failure_hits,
+            }
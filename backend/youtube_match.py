@@ -0,0 +1,127 @@
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Set
+
+from metrics import YOUTUBE_MATCHES
+
+# Candidates fetched per search; flat searches cost about the same for 1 or 10 results
+MATCH_CANDIDATES = max(1, int(os.getenv("YOUTUBE_MATCH_CANDIDATES", "5")))
+# Best candidates scoring below this are treated as no match rather than downloaded
+MIN_MATCH_CONFIDENCE = float(os.getenv("YOUTUBE_MIN_CONFIDENCE", "0.5"))
+
+# Seconds of drift that still count as the same recording (encoder padding, fades)
+DURATION_EXACT_SECONDS = 3
+# Beyond max(this, DURATION_MAX_DRIFT_RATIO * length) a candidate is a different cut (intro, loop, live)
+DURATION_MAX_DRIFT_SECONDS = 45
+DURATION_MAX_DRIFT_RATIO = 0.33
+
+# Words that mark a different version unless the Spotify title or artist has them too
+VARIANT_TERMS = {
+    "live", "cover", "karaoke", "instrumental", "remix", "reaction", "nightcore", "slowed",
+    "sped", "reverb", "8d", "loop", "hour", "hours", "tutorial", "lesson", "mashup",
+}
+# Spotify title decorations that rarely appear in YouTube titles
+TITLE_NOISE = {"feat", "ft", "featuring", "with", "remastered", "remaster", "version", "edit", "mono", "stereo"}
+
+_WORD_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+# "Song - Remastered 2011", "Song (feat. X)": the core title is the part before these
+_TITLE_SUFFIX_PATTERN = re.compile(r"\s+-\s+|\s*[(\[]")
+
+WEIGHT_TITLE = 0.6
+WEIGHT_ARTIST = 0.4
+
+
+def search_url(query: str, candidates: int = MATCH_CANDIDATES) -> str:
+    return f"ytsearch{candidates}:{query}"
+
+
+def _words(text: Optional[str]) -> Set[str]:
+    return set(_WORD_PATTERN.findall((text or "").lower()))
+
+
+def _coverage(wanted: Set[str], present: Set[str]) -> float:
+    return len(wanted & present) / len(wanted) if wanted else 1.0
+
+
+class TrackMatcher:
+    """
+    Scores YouTube search candidates against one Spotify track. The track side (words,
+    duration window) is prepared once and reused for every candidate of every search.
+    """
+
+    def __init__(self, track_name: str, artist: str, duration_ms: Optional[int] = None):
+        core_title = _TITLE_SUFFIX_PATTERN.split(track_name, 1)[0] or track_name
+        self.title_words = (_words(core_title) - TITLE_NOISE) or _words(track_name)
+        self.artist_words = _words(artist)
+        self.allowed_variants = VARIANT_TERMS & (_words(track_name) | self.artist_words)
+        self.duration = duration_ms / 1000 if duration_ms else None
+        if self.duration:
+            self.max_drift = max(DURATION_MAX_DRIFT_SECONDS, DURATION_MAX_DRIFT_RATIO * self.duration)
+
+    def _duration_score(self, candidate_duration: Optional[float]) -> Optional[float]:
+        """1.0 within a few seconds, falling linearly to 0 at the drift limit; None when unknown"""
+        if not self.duration or not candidate_duration:
+            return None
+        drift = abs(candidate_duration - self.duration)
+        if drift <= DURATION_EXACT_SECONDS:
+            return 1.0
+        return max(0.0, 1.0 - (drift - DURATION_EXACT_SECONDS) / (self.max_drift - DURATION_EXACT_SECONDS))
+
+    def score(self, entry: Dict) -> float:
+        """Confidence in [0, 1] that a search entry is this track's audio"""
+        title_words = _words(entry.get('title'))
+        channel = entry.get('channel') or entry.get('uploader') or ""
+        channel_words = _words(channel)
+
+        duration_score = self._duration_score(entry.get('duration'))
+        if duration_score == 0.0:
+            return 0.0
+        if duration_score is None:
+            # Without both durations the text has to carry the decision, at a discount
+            duration_score = 0.5
+
+        title_score = _coverage(self.title_words, title_words)
+        artist_score = _coverage(self.artist_words, title_words | channel_words)
+        # YouTube Music "Artist - Topic" channels carry the studio recording
+        if channel.endswith(" - Topic") and artist_score > 0:
+            artist_score = 1.0
+
+        # A matching length only confirms a text match; it never makes one on its own
+        text_score = WEIGHT_TITLE * title_score + WEIGHT_ARTIST * artist_score
+        confidence = text_score * (0.5 + 0.5 * duration_score)
+        if (title_words & VARIANT_TERMS) - self.allowed_variants:
+            confidence *= 0.5
+        return round(confidence, 3)
+
+    def rank(self, info: Optional[Dict]) -> List[Dict]:
+        """All candidates of a yt-dlp search result as video dicts with confidence, best first"""
+        if not info:
+            return []
+        entries = info.get('entries') if 'entries' in info else [info]
+        videos = [
+            {
+                "id": entry['id'],
+                "title": entry.get('title'),
+                "duration": entry.get('duration'),
+                "confidence": self.score(entry),
+            }
+            for entry in (entries or []) if entry and entry.get('id')
+        ]
+        # Stable sort keeps YouTube's relevance order between equal scores
+        videos.sort(key=lambda video: video['confidence'], reverse=True)
+        return videos
+
+    def best(self, info: Optional[Dict], min_confidence: float = MIN_MATCH_CONFIDENCE) -> Optional[Dict]:
+        """The highest scoring candidate, or None when nothing reaches min_confidence"""
+        ranked = self.rank(info)
+        if not ranked:
+            YOUTUBE_MATCHES.inc(outcome="empty")
+            return None
+        if ranked[0]['confidence'] < min_confidence:
+            YOUTUBE_MATCHES.inc(outcome="rejected")
+            logging.info(f"Rejected {len(ranked)} candidates, best {ranked[0]['title']!r} "
+                         f"at {ranked[0]['confidence']:.2f}")
+            return None
+        YOUTUBE_MATCHES.inc(outcome="accepted")
+        return ranked[0]
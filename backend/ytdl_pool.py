@@ -0,0 +1,134 @@
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Optional
+
+from yt_dlp import YoutubeDL
+
+from youtube_access import YouTubeAccessController
+
+
+class PooledYoutubeDL:
+    """A YoutubeDL built once for a profile, whose output template and hooks are set per lease"""
+
+    def __init__(self, params: Dict):
+        self.ydl = YoutubeDL(dict(params))
+        self._default_outtmpl = self.ydl.params['outtmpl'].get('default')
+
+        self.progress_hooks: List[Callable] = []
+        self.postprocessor_hooks: List[Callable] = []
+        self.post_hooks: List[Callable] = []
+
+        # Registered once; they forward to whatever the current lease asked for
+        self.ydl.add_progress_hook(lambda d: [hook(d) for hook in self.progress_hooks])
+        self.ydl.add_postprocessor_hook(lambda d: [hook(d) for hook in self.postprocessor_hooks])
+        self.ydl.add_post_hook(lambda path: [hook(path) for hook in self.post_hooks])
+
+    def configure(self, outtmpl: Optional[str], progress_hooks: Iterable[Callable],
+                  postprocessor_hooks: Iterable[Callable], post_hooks: Iterable[Callable]):
+        if outtmpl is not None:
+            self.ydl.params['outtmpl']['default'] = outtmpl
+        self.progress_hooks = list(progress_hooks)
+        self.postprocessor_hooks = list(postprocessor_hooks)
+        self.post_hooks = list(post_hooks)
+
+    def reset(self):
+        self.configure(self._default_outtmpl, (), (), ())
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logging.debug(f"Error closing pooled YoutubeDL: {e}")
+
+
+class YoutubeDLPool:
+    """
+    Thread-safe supply of preconfigured YoutubeDL instances, kept per option profile
+    (flat search, audio download, ...) so calls skip extractor and option setup.
+    Leases go through the access controller, when given, so every call shares its
+    concurrency limit and circuit breaker.
+    """
+
+    def __init__(self, max_idle_per_profile: int = 8, access: Optional[YouTubeAccessController] = None):
+        self.max_idle_per_profile = max_idle_per_profile
+        self.access = access
+        self._profiles: Dict[str, Dict] = {}
+        self._latency_targets: Dict[str, Optional[float]] = {}
+        self._idle: Dict[str, List[PooledYoutubeDL]] = {}
+        self._created: Dict[str, int] = {}
+        self._reused: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def register(self, profile: str, params: Dict, latency_target: Optional[float] = None):
+        """
+        Define (or redefine) the options instances of a profile are built with. Calls slower
+        than latency_target count as congestion; leave it unset for downloads, whose time
+        depends on the file.
+        """
+        with self._lock:
+            stale = self._idle.get(profile, [])
+            self._profiles[profile] = dict(params)
+            self._latency_targets[profile] = latency_target
+            self._idle[profile] = []
+            self._created.setdefault(profile, 0)
+            self._reused.setdefault(profile, 0)
+
+        for entry in stale:
+            entry.close()
+
+    @contextmanager
+    def acquire(self, profile: str, outtmpl: Optional[str] = None,
+                progress_hooks: Iterable[Callable] = (), postprocessor_hooks: Iterable[Callable] = (),
+                post_hooks: Iterable[Callable] = (), wait: bool = False):
+        """
+        Lease an instance for the current thread. Instances that raised are discarded
+        rather than returned, since their internal state may be inconsistent.
+        wait is passed to the access controller: background work waits out an open circuit.
+        """
+        slot = (self.access.slot(wait=wait, latency_target=self._latency_targets.get(profile))
+                if self.access else nullcontext())
+        with slot, self._lease(profile, outtmpl, progress_hooks, postprocessor_hooks, post_hooks) as ydl:
+            yield ydl
+
+    @contextmanager
+    def _lease(self, profile: str, outtmpl: Optional[str], progress_hooks: Iterable[Callable],
+               postprocessor_hooks: Iterable[Callable], post_hooks: Iterable[Callable]):
+        with self._lock:
+            params = self._profiles[profile]
+            idle = self._idle[profile]
+            entry = idle.pop() if idle else None
+            if entry:
+                self._reused[profile] += 1
+            else:
+                self._created[profile] += 1
+
+        if entry is None:
+            entry = PooledYoutubeDL(params)
+
+        entry.configure(outtmpl, progress_hooks, postprocessor_hooks, post_hooks)
+        try:
+            yield entry.ydl
+        except BaseException:
+            entry.close()
+            raise
+
+        entry.reset()
+        with self._lock:
+            idle = self._idle.get(profile)
+            # The profile may have been re-registered while this instance was out
+            if idle is not None and self._profiles.get(profile) is params and len(idle) < self.max_idle_per_profile:
+                idle.append(entry)
+                return
+        entry.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                profile: {
+                    "created": self._created[profile],
+                    "reused": self._reused[profile],
+                    "idle": len(self._idle[profile]),
+                }
+                for profile in self._profiles
+            }
@@ -0,0 +1,46 @@
+import io
+import zipfile
+from typing import Iterable, Iterator, List, Tuple
+
+ZIP_CHUNK_SIZE = 256 * 1024
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable sink; zipfile then streams entries with data descriptors"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        yield from chunks
+
+
+def stream_zip(files: Iterable[Tuple[str, str]], chunk_size: int = ZIP_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yield a stored (uncompressed) ZIP of (archive name, path) pairs as it is built.
+    Only one chunk of one file is held at a time, so memory does not grow with the archive.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for arcname, path in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, archive.open(info, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    # Central directory
+    yield from sink.drain()
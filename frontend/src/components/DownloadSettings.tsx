@@ -10,6 +10,7 @@ type YouTubeLink = {
   youtube_url?: string;
   youtube_id?: string;
   title?: string;
+  confidence?: number;
   success: boolean;
   error?: string;
 };
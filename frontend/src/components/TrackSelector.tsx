@@ -90,7 +90,9 @@ const TrackSelector = ({
           "/stream-track", 
           {
             track_name: track.name,
-            artist: track.artists[0]
+            artist: track.artists[0],
+            track_id: track.id,
+            duration_ms: track.duration_ms
           },
           {
             responseType: "blob"